@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import faiss
+import numpy as np
+from typing import Dict, List, Optional
+from vector_store import (
+    QUANTIZED_TYPES, VectorStore, build_index, search_params, index_memory_bytes, default_nlist, rerank
+)
+
+def synthetic_store(path: str, n: int, dim: int, clusters: int = 64, seed: int = 0) -> VectorStore:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    store = VectorStore(path, dim)
+    batch_size = 10000
+    for start in range(0, n, batch_size):
+        size = min(batch_size, n - start)
+        vectors = centers[rng.integers(0, clusters, size)] + 0.5 * rng.standard_normal((size, dim)).astype('float32')
+        faiss.normalize_L2(vectors)
+        store.append(range(start, start + size), vectors)
+    return store
+
+def make_queries(store: VectorStore, n: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    queries = store.sample(n, seed=seed)
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype('float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+def run_queries(index, queries: np.ndarray, k: int, params, store: Optional[VectorStore] = None,
+                rerank_factor: int = 1) -> Dict:
+    latencies = []
+    labels = np.empty((len(queries), k), dtype='int64')
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        if rerank_factor > 1:
+            _, candidates = index.search(query[None, :], k * rerank_factor, params=params)
+            _, found = rerank(store, query[None, :], candidates, k)
+        else:
+            _, found = index.search(query[None, :], k, params=params)
+        latencies.append(time.perf_counter() - start)
+        labels[i] = found[0]
+    return {"labels": labels, "latencies_ms": np.array(latencies) * 1000}
+
+def recall_at_k(labels: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(found[found >= 0]) & set(expected)) for found, expected in zip(labels, truth))
+    return hits / truth.size
+
+def benchmark(store: VectorStore, index_types: List[str], k: int, num_queries: int,
+              nprobes: List[int], ef_searches: List[int], nlist: Optional[int] = None,
+              rerank_factor: int = 4) -> List[Dict]:
+    queries = make_queries(store, num_queries)
+    results = []
+    truth = None
+
+    for index_type in ["flat"] + [t for t in index_types if t != "flat"]:
+        start = time.perf_counter()
+        index = build_index(index_type, store.dim, store, nlist=nlist)
+        build_seconds = time.perf_counter() - start
+
+        if index_type in ("ivf", "ivfpq"):
+            settings = [("nprobe", value) for value in nprobes]
+        elif index_type == "hnsw":
+            settings = [("ef_search", value) for value in ef_searches]
+        else:
+            settings = [(None, None)]
+
+        # Quantized indexes are measured both on their codes alone and re-ranked from the store.
+        rerank_factors = [1, rerank_factor] if index_type in QUANTIZED_TYPES and rerank_factor > 1 else [1]
+        for (name, value), factor in [(setting, f) for setting in settings for f in rerank_factors]:
+            params = search_params(index_type, **({name: value} if name else {}))
+            run = run_queries(index, queries, k, params, store, factor)
+            if truth is None:
+                truth = run["labels"]
+            results.append({
+                "index_type": index_type,
+                "param": name,
+                "value": value,
+                "rerank": factor if factor > 1 else None,
+                "vectors": len(store),
+                "nlist": (nlist or default_nlist(len(store))) if index_type in ("ivf", "ivfpq") else None,
+                f"recall@{k}": round(recall_at_k(run["labels"], truth), 4),
+                "p50_ms": round(float(np.percentile(run["latencies_ms"], 50)), 3),
+                "p99_ms": round(float(np.percentile(run["latencies_ms"], 99)), 3),
+                "memory_mb": round(index_memory_bytes(index) / 1e6, 2),
+                "compression": round(len(store) * store.dim * 4 / index_memory_bytes(index), 1),
+                "build_s": round(build_seconds, 2),
+            })
+    return [r for r in results if r["index_type"] in index_types]
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency/memory comparison of faiss index types")
+    parser.add_argument("--vectors", default="vector_index.vectors",
+                        help="Vector store prefix written by SearchEngine")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Benchmark N synthetic vectors instead of the stored corpus")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--types", default="flat,ivf,hnsw,ivfpq,sq8,pq")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", default="1,8,32")
+    parser.add_argument("--ef-search", default="16,64,128")
+    parser.add_argument("--rerank", type=int, default=4,
+                        help="Candidates per result re-scored with full-precision vectors for quantized types")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.synthetic:
+            store = synthetic_store(os.path.join(tmp_dir, "vectors"), args.synthetic, args.dim)
+        else:
+            if not os.path.exists(f"{args.vectors}.f32"):
+                parser.error(f"No vectors found at {args.vectors}; build the index first or pass --synthetic N")
+            store = VectorStore(args.vectors, args.dim)
+
+        results = benchmark(
+            store,
+            index_types=args.types.split(","),
+            k=args.k,
+            num_queries=args.queries,
+            nprobes=[int(v) for v in args.nprobe.split(",")],
+            ef_searches=[int(v) for v in args.ef_search.split(",")],
+            nlist=args.nlist,
+            rerank_factor=args.rerank
+        )
+
+    columns = ["index_type", "param", "value", "rerank", f"recall@{args.k}", "p50_ms", "p99_ms", "memory_mb",
+               "compression", "build_s"]
+    print("  ".join(f"{c:>12}" for c in columns))
+    for row in results:
+        print("  ".join(f"{str(row[c]):>12}" for c in columns))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
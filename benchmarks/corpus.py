@@ -0,0 +1,84 @@
+import random
+import itertools
+from html import escape
+from typing import List, Dict
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "tu", "ne", "so", "vi", "da", "pe", "zo", "qui", "ba", "fe", "gu", "hy"]
+
+def vocabulary(size: int = 5000, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+# Words are drawn from a Zipf-like distribution so term frequencies, posting list lengths and
+# query selectivity look like natural text rather than uniform noise.
+class CorpusGenerator:
+    def __init__(self, vocab_size: int = 5000, seed: int = 0, zipf_s: float = 1.1):
+        self.rng = random.Random(seed)
+        self.words = vocabulary(vocab_size, seed)
+        self.rng.shuffle(self.words)
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** zipf_s for rank in range(vocab_size)))
+
+    def words_sample(self, n: int) -> List[str]:
+        return self.rng.choices(self.words, cum_weights=self.cum_weights, k=n)
+
+    def sentence(self, n: int) -> str:
+        return " ".join(self.words_sample(n)).capitalize() + "."
+
+    def text(self, words: int) -> str:
+        sentences = []
+        while words > 0:
+            length = min(words, self.rng.randint(6, 18))
+            sentences.append(self.sentence(length))
+            words -= length
+        return " ".join(sentences)
+
+    def page(self, url: str, words_per_page: int = 300) -> Dict:
+        content = self.text(max(20, int(self.rng.gauss(words_per_page, words_per_page / 4))))
+        return {
+            "url": url,
+            "title": self.sentence(self.rng.randint(3, 6)).rstrip("."),
+            "description": self.sentence(12),
+            "keywords": self.words_sample(4),
+            "last_modified": None,
+            "content": content,
+            "word_count": len(content.split())
+        }
+
+    def pages(self, n: int, base_url: str = "http://bench.local", words_per_page: int = 300) -> List[Dict]:
+        return [self.page(f"{base_url}/page/{i}", words_per_page) for i in range(n)]
+
+    def queries(self, n: int, min_words: int = 1, max_words: int = 3) -> List[str]:
+        return [" ".join(self.words_sample(self.rng.randint(min_words, max_words))) for _ in range(n)]
+
+def site_graph(n: int, links_per_page: int = 8, seed: int = 0) -> List[List[int]]:
+    rng = random.Random(seed)
+    graph = []
+    for i in range(n):
+        # A link to the next page keeps every page reachable from page 0.
+        links = {(i + 1) % n}
+        while len(links) < min(links_per_page, n - 1):
+            links.add(rng.randrange(n))
+        links.discard(i)
+        graph.append(sorted(links))
+    return graph
+
+def render_page(page: Dict, links: List[str]) -> str:
+    anchors = "\n".join(f'<li><a href="{href}">{escape(href)}</a></li>' for href in links)
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<title>{escape(page["title"])}</title>
+<meta name="description" content="{escape(page["description"])}">
+<meta name="keywords" content="{escape(", ".join(page["keywords"]))}">
+</head>
+<body>
+<nav><a href="/page/0">Home</a></nav>
+<main><h1>{escape(page["title"])}</h1><p>{escape(page["content"])}</p></main>
+<div class="related"><ul>
+{anchors}
+</ul></div>
+</body>
+</html>"""
@@ -0,0 +1,49 @@
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator
+
+from benchmarks.corpus import CorpusGenerator, render_page, site_graph
+
+def build_site(num_pages: int, links_per_page: int = 8, words_per_page: int = 300, seed: int = 0) -> Dict[str, bytes]:
+    generator = CorpusGenerator(seed=seed)
+    graph = site_graph(num_pages, links_per_page, seed)
+    site = {"/robots.txt": b"User-agent: *\nDisallow: /private\n"}
+    for i, links in enumerate(graph):
+        page = generator.page(f"/page/{i}", words_per_page)
+        site[f"/page/{i}"] = render_page(page, [f"/page/{j}" for j in links]).encode("utf-8")
+    return site
+
+# Serves a pre-rendered site from memory on localhost, so crawl throughput is measured
+# without network variance and the crawler is the bottleneck.
+@contextmanager
+def serve_site(site: Dict[str, bytes], host: str = "127.0.0.1", port: int = 0) -> Iterator[str]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = site.get(self.path.split("?", 1)[0])
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            content_type = "text/plain" if self.path.endswith(".txt") else "text/html; charset=utf-8"
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+# Each measurement runs in a fresh interpreter so import, model and index load costs are paid
+# exactly as on a cold API start; only the OS page cache carries over between runs.
+def probe(query: str, warm_up: bool) -> Dict:
+    start = time.perf_counter()
+    import search_api
+    timings = {"import_s": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    engine = search_api.get_search_engine()
+    timings["load_s"] = time.perf_counter() - start
+    if engine is None:
+        raise SystemExit("No documents found; crawl some websites before benchmarking startup")
+
+    if warm_up:
+        start = time.perf_counter()
+        engine.warm_up()
+        timings["warmup_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.search(query)
+    timings["first_query_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    engine.search(query + " guide")
+    timings["second_query_ms"] = (time.perf_counter() - start) * 1000
+    return timings
+
+def measure(runs: int, query: str, warm_up: bool, mmap: bool) -> Dict:
+    env = dict(os.environ, KOALA_INDEX_MMAP="1" if mmap else "0", KOALA_PRELOAD="0")
+    command = [sys.executable, "-m", "benchmarks.startup_benchmark", "--probe", "--query", query]
+    if not warm_up:
+        command.append("--no-warmup")
+
+    samples: List[Dict] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        total_s = time.perf_counter() - start
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_s"] = total_s
+        samples.append(sample)
+
+    result = {"mmap": mmap, "warm_up": warm_up, "runs": runs}
+    for key in samples[0]:
+        result[key] = round(statistics.median(sample[key] for sample in samples), 3)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start and first-query latency of the search API")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--query", default="python tutorial")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--no-warmup", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.query, warm_up=not args.no_warmup)))
+        return
+
+    results = [
+        measure(args.runs, args.query, warm_up=False, mmap=False),
+        measure(args.runs, args.query, warm_up=True, mmap=False),
+        measure(args.runs, args.query, warm_up=True, mmap=True),
+    ]
+
+    columns = ["mmap", "warm_up", "import_s", "load_s", "warmup_s", "first_query_ms", "second_query_ms", "process_s"]
+    print("  ".join(f"{c:>15}" for c in columns))
+    for row in results:
+        print("  ".join(f"{str(row.get(c, '-')):>15}" for c in columns))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
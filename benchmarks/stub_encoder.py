@@ -0,0 +1,29 @@
+import re
+import hashlib
+import numpy as np
+from typing import List
+
+# Deterministic stand-in for SentenceTransformer: signed feature hashing of words and word
+# bigrams. Texts sharing terms get similar vectors, so index and recall behave sensibly,
+# and no model has to be downloaded.
+class StubEncoder:
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _features(self, text: str) -> List[str]:
+        words = re.findall(r'\w+', text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        embeddings = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                embeddings[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        return embeddings
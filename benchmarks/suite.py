@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import numpy as np
+from datetime import datetime
+from typing import Dict, List
+
+from benchmarks.corpus import CorpusGenerator
+from benchmarks.site_server import build_site, serve_site
+from benchmarks.stub_encoder import StubEncoder
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def percentiles(latencies_ms: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(np.mean(latencies_ms)), 3)
+    }
+
+def crawl_scenario(args) -> Dict:
+    from crawler import Crawler
+
+    site = build_site(args.pages, words_per_page=args.words, seed=args.seed)
+    with serve_site(site) as base_url:
+        crawler = Crawler(parser=args.parser, parse_workers=args.parse_workers)
+        start = time.perf_counter()
+        data = asyncio.run(crawler.crawl_async(
+            f"{base_url}/page/0",
+            max_pages=args.pages,
+            max_depth=args.pages,
+            concurrency=args.crawl_concurrency,
+            per_host_concurrency=args.crawl_concurrency,
+            requests_per_second=1e6,
+            burst=args.crawl_concurrency
+        ))
+        seconds = time.perf_counter() - start
+    return {
+        "pages": len(data),
+        "seconds": round(seconds, 3),
+        "pages_per_s": round(len(data) / seconds, 2),
+        "parser": crawler.parser,
+        "parse_workers": crawler.parse_workers,
+        "concurrency": args.crawl_concurrency
+    }
+
+def build_engine(workdir: str, pages: List[Dict], index_type: str):
+    from document_store import DocumentStore
+    from bm25_index import BM25Index
+    from search_engine import SearchEngine
+
+    store = DocumentStore(os.path.join(workdir, "documents"))
+    start = time.perf_counter()
+    store.put_many(pages)
+    store_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lexical = BM25Index(os.path.join(workdir, "lexical_index.db"))
+    lexical.sync(store)
+    lexical_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = SearchEngine(store, cache_path=os.path.join(workdir, "vector_index"), index_type=index_type,
+                          lexical=lexical, encoder=StubEncoder())
+    index_s = time.perf_counter() - start
+    timings = {"store_s": round(store_s, 3), "lexical_s": round(lexical_s, 3), "index_s": round(index_s, 3)}
+    return store, lexical, engine, timings
+
+def index_run(index_type: str, pages: List[Dict], extra_pages: List[Dict]) -> Dict:
+    from vector_store import index_memory_bytes
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store, lexical, engine, timings = build_engine(workdir, pages, index_type)
+
+        store.put_many(extra_pages)
+        start = time.perf_counter()
+        lexical.sync(store)
+        engine.sync_index()
+        sync_s = time.perf_counter() - start
+
+        result = dict(
+            timings,
+            index_type=engine.active_index_type,
+            documents=len(store),
+            passages=len(engine.vectors),
+            incremental_docs=len(extra_pages),
+            incremental_sync_s=round(sync_s, 3),
+            index_mb=round(index_memory_bytes(engine.index) / 1e6, 2),
+            peak_rss_mb=peak_rss_mb()
+        )
+        store.close()
+    return result
+
+# ru_maxrss is the lifetime peak of a process, so each index type is built in a fresh
+# interpreter (regenerating the same seeded corpus) and its peak_rss_mb is its own.
+def index_scenario(args) -> List[Dict]:
+    results = []
+    for index_type in args.index_types.split(","):
+        command = [sys.executable, "-m", "benchmarks.suite", "--index-probe", index_type,
+                   "--pages", str(args.pages), "--words", str(args.words), "--seed", str(args.seed)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+async def run_search_load(client, queries: List[str], concurrency: int, mode: str) -> Dict:
+    pending = list(queries)
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while pending:
+            query = pending.pop()
+            start = time.perf_counter()
+            response = await client.get("/search", params={"q": query, "mode": mode, "expand": "false"})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    return dict(percentiles(latencies), mode=mode, concurrency=concurrency, requests=len(latencies),
+                errors=errors, qps=round(len(latencies) / seconds, 1))
+
+def search_scenario(args, pages: List[Dict], generator: CorpusGenerator) -> List[Dict]:
+    import httpx
+    import search_api
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store, lexical, engine, _ = build_engine(workdir, pages, args.index_types.split(",")[0])
+        search_api.document_store = store
+        search_api.lexical_index = lexical
+        search_api.search_engine = engine
+
+        async def run() -> List[Dict]:
+            results = []
+            transport = httpx.ASGITransport(app=search_api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for mode in args.modes.split(","):
+                    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                        engine.result_cache.clear()
+                        results.append(await run_search_load(client, generator.queries(args.requests),
+                                                             concurrency, mode))
+            if search_api.search_batcher is not None:
+                await search_api.search_batcher.close()
+                search_api.search_batcher = None
+            return results
+
+        results = asyncio.run(run())
+        search_api.search_engine = None
+        search_api.lexical_index = None
+        search_api.document_store = None
+        store.close()
+    return results
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline crawl, index and query benchmarks")
+    parser.add_argument("--scenarios", default="crawl,index,search")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--words", type=int, default=300, help="Mean words per generated page")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parser", default="html.parser")
+    parser.add_argument("--parse-workers", type=int, default=None)
+    parser.add_argument("--crawl-concurrency", type=int, default=16)
+    parser.add_argument("--index-types", default="flat,hnsw,sq8")
+    parser.add_argument("--modes", default="vector,bm25,hybrid")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=400, help="Search requests per concurrency level")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    parser.add_argument("--index-probe", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    generator = CorpusGenerator(seed=args.seed)
+    pages = generator.pages(args.pages, words_per_page=args.words)
+    extra_pages = generator.pages(max(1, args.pages // 10), base_url="http://bench.local/new",
+                                  words_per_page=args.words)
+    if args.index_probe:
+        print(json.dumps(index_run(args.index_probe, pages, extra_pages)))
+        return
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "results": {}
+    }
+
+    if "crawl" in scenarios:
+        report["results"]["crawl"] = crawl_scenario(args)
+        print(f"crawl: {report['results']['crawl']}")
+    if "index" in scenarios:
+        report["results"]["index"] = index_scenario(args)
+        for row in report["results"]["index"]:
+            print(f"index: {row}")
+    if "search" in scenarios:
+        report["results"]["search"] = search_scenario(args, pages, generator)
+        columns = ["mode", "concurrency", "requests", "qps", "p50_ms", "p99_ms", "errors"]
+        print("  ".join(f"{c:>12}" for c in columns))
+        for row in report["results"]["search"]:
+            print("  ".join(f"{str(row[c]):>12}" for c in columns))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import re
+import json
+import math
+import sqlite3
+import threading
+import numpy as np
+from array import array
+from collections import Counter, defaultdict
+from typing import List, Dict, Optional, Iterable, Tuple
+from document_store import DocumentStore
+from search_cache import LRUCache
+from snippets import term_offsets, sentence_starts
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9](?:[a-z0-9_.\-]*[a-z0-9])?")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def document_terms(entry: Dict, title_weight: int = 2) -> Counter:
+    terms = Counter(tokenize(entry.get("content", "")))
+    for _ in range(title_weight):
+        terms.update(tokenize(entry.get("title", "")))
+    for keyword in entry.get("keywords", []) or []:
+        terms.update(tokenize(keyword))
+    return terms
+
+# Postings are stored per term as three packed arrays (doc ids, term frequencies,
+# document lengths) so a query term is one row read and scoring is vectorised.
+class BM25Index:
+    def __init__(self, path: str = 'lexical_index.db', k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.posting_cache = LRUCache(4096, 3600)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL);
+            CREATE TABLE IF NOT EXISTS docs (doc_id INTEGER PRIMARY KEY, length INTEGER, terms TEXT);
+            CREATE TABLE IF NOT EXISTS postings (term TEXT PRIMARY KEY, doc_ids BLOB, tfs BLOB, lengths BLOB);
+            CREATE TABLE IF NOT EXISTS term_offsets (
+                doc_id INTEGER, term TEXT, offsets BLOB, PRIMARY KEY (doc_id, term)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sentences (doc_id INTEGER PRIMARY KEY, starts BLOB);
+        """)
+        self.num_docs = int(self._get_meta("num_docs"))
+        self.total_length = int(self._get_meta("total_length"))
+
+    def _get_meta(self, key: str) -> float:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def _load_posting(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        row = self.conn.execute(
+            "SELECT doc_ids, tfs, lengths FROM postings WHERE term = ?", (term,)
+        ).fetchone()
+        if row is None:
+            return None
+        return (np.frombuffer(row[0], dtype='int64'), np.frombuffer(row[1], dtype='uint32'),
+                np.frombuffer(row[2], dtype='uint32'))
+
+    def update(self, documents: Iterable[Tuple[int, Dict]], removed_ids: Iterable[int] = ()) -> Dict[str, int]:
+        with self.lock, self.conn:
+            removals: Dict[str, set] = defaultdict(set)
+            additions: Dict[str, List[Tuple[int, int, int]]] = defaultdict(list)
+
+            documents = list(documents)
+            readded = {doc_id for doc_id, _ in documents}
+            removed_ids = set(removed_ids) - readded
+            removed = 0
+            for doc_id in removed_ids | readded:
+                row = self.conn.execute("SELECT length, terms FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row is None:
+                    continue
+                for term in json.loads(row[1]):
+                    removals[term].add(doc_id)
+                self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+                self._delete_offsets(doc_id)
+                self.num_docs -= 1
+                self.total_length -= row[0]
+                removed += doc_id in removed_ids
+
+            for doc_id, entry in documents:
+                terms = document_terms(entry)
+                length = sum(terms.values())
+                self.conn.execute(
+                    "INSERT INTO docs (doc_id, length, terms) VALUES (?, ?, ?)",
+                    (doc_id, length, json.dumps(list(terms)))
+                )
+                self.num_docs += 1
+                self.total_length += length
+                for term, tf in terms.items():
+                    additions[term].append((doc_id, tf, length))
+                self._store_offsets(doc_id, entry.get("content", ""))
+
+            for term in set(removals) | set(additions):
+                posting = self._load_posting(term)
+                doc_ids, tfs, lengths = posting if posting else (
+                    np.empty(0, 'int64'), np.empty(0, 'uint32'), np.empty(0, 'uint32'))
+                if term in removals:
+                    keep = ~np.isin(doc_ids, np.fromiter(removals[term], dtype='int64'))
+                    doc_ids, tfs, lengths = doc_ids[keep], tfs[keep], lengths[keep]
+                if term in additions:
+                    added = np.array(additions[term], dtype='int64')
+                    doc_ids = np.concatenate([doc_ids, added[:, 0]])
+                    tfs = np.concatenate([tfs, added[:, 1].astype('uint32')])
+                    lengths = np.concatenate([lengths, added[:, 2].astype('uint32')])
+
+                if len(doc_ids):
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO postings (term, doc_ids, tfs, lengths) VALUES (?, ?, ?, ?)",
+                        (term, doc_ids.tobytes(), tfs.tobytes(), lengths.tobytes())
+                    )
+                else:
+                    self.conn.execute("DELETE FROM postings WHERE term = ?", (term,))
+
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                ("num_docs", self.num_docs), ("total_length", self.total_length)
+            ])
+            self.generation += 1
+            self.posting_cache.clear()
+            return {"indexed": len(documents), "removed": removed}
+
+    # Content token offsets and sentence starts per document, written at index time so
+    # snippets only read the positions of the query terms.
+    def _store_offsets(self, doc_id: int, content: str):
+        self.conn.execute("INSERT OR REPLACE INTO sentences (doc_id, starts) VALUES (?, ?)",
+                          (doc_id, sentence_starts(content).tobytes()))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO term_offsets (doc_id, term, offsets) VALUES (?, ?, ?)",
+            [(doc_id, term, offsets.tobytes()) for term, offsets in term_offsets(content).items()]
+        )
+
+    def _delete_offsets(self, doc_id: int):
+        self.conn.execute("DELETE FROM sentences WHERE doc_id = ?", (doc_id,))
+        self.conn.execute("DELETE FROM term_offsets WHERE doc_id = ?", (doc_id,))
+
+    def snippet_offsets(self, doc_id: int, query: str) -> Optional[Tuple[array, Dict[str, array]]]:
+        terms = sorted(set(tokenize(query)))
+        with self.lock:
+            row = self.conn.execute("SELECT starts FROM sentences WHERE doc_id = ?", (int(doc_id),)).fetchone()
+            if row is None:
+                return None
+            rows = self.conn.execute(
+                f"SELECT term, offsets FROM term_offsets WHERE doc_id = ? AND term IN ({','.join('?' * len(terms))})",
+                (int(doc_id), *terms)
+            ).fetchall() if terms else []
+        starts = array('I')
+        starts.frombytes(row[0])
+        offsets = {}
+        for term, blob in rows:
+            offsets[term] = array('I')
+            offsets[term].frombytes(blob)
+        return starts, offsets
+
+    # With doc_ids (a streamed crawl batch) only those documents are indexed or removed; the
+    # full comparison against the store and the offsets backfill wait for a full sync.
+    def sync(self, store: DocumentStore, batch_size: int = 500,
+             doc_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        if doc_ids is None:
+            with self.lock:
+                indexed_ids = {doc_id for (doc_id,) in self.conn.execute("SELECT doc_id FROM docs")}
+            removed_ids = indexed_ids - set(store.ids())
+        else:
+            doc_ids = set(doc_ids)
+            removed_ids = doc_ids - store.present_ids(doc_ids)
+        stats = {"indexed": 0, "removed": 0}
+        if removed_ids:
+            stats["removed"] += self.update([], removed_ids)["removed"]
+        for batch in store.pending_lexical(batch_size, doc_ids):
+            self.update([(doc_id, entry) for doc_id, _, entry in batch])
+            store.mark_lexical((doc_id, doc_hash) for doc_id, doc_hash, _ in batch)
+            stats["indexed"] += len(batch)
+        if doc_ids is not None:
+            return stats
+
+        # Documents indexed before snippet offsets existed get them backfilled once.
+        with self.lock:
+            missing = [doc_id for (doc_id,) in self.conn.execute(
+                "SELECT doc_id FROM docs WHERE doc_id NOT IN (SELECT doc_id FROM sentences)"
+            )]
+        for start in range(0, len(missing), batch_size):
+            with self.lock, self.conn:
+                for doc_id in missing[start:start + batch_size]:
+                    document = store.get_document(doc_id)
+                    if document is not None:
+                        self._store_offsets(doc_id, document.get("content", ""))
+        return stats
+
+    # Returns the top-k scores and doc IDs plus the number of documents matching any term.
+    def search(self, query: str, k: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, int]:
+        terms = set(tokenize(query))
+        if not terms or not self.num_docs:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64'), 0
+        avg_length = self.total_length / self.num_docs
+
+        all_ids, all_scores = [], []
+        with self.lock:
+            for term in terms:
+                posting = self.posting_cache.get((self.generation, term))
+                if posting is None:
+                    posting = self._load_posting(term)
+                    self.posting_cache.put((self.generation, term), posting or ())
+                if not posting:
+                    continue
+                doc_ids, tfs, lengths = posting
+                idf = math.log(1 + (self.num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+                tf = tfs.astype('float32')
+                norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+                all_ids.append(doc_ids)
+                all_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+        if not all_ids:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64'), 0
+        doc_ids = np.concatenate(all_ids)
+        scores = np.concatenate(all_scores)
+        if allowed_ids is not None:
+            mask = np.isin(doc_ids, allowed_ids)
+            doc_ids, scores = doc_ids[mask], scores[mask]
+        unique_ids, inverse = np.unique(doc_ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores).astype('float32')
+
+        k = min(k, len(unique_ids))
+        if k == 0:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64'), 0
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return totals[top], unique_ids[top], len(unique_ids)
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,64 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Optional
+
+# Bounded pool for crawl jobs. Each job runs on its own worker thread (a crawl drives its own
+# event loop there), so crawling, checkpointing and ingestion never block the API event loop.
+# Jobs beyond max_concurrent wait in the executor queue.
+class CrawlPool:
+    def __init__(self, max_concurrent: int = 2):
+        self.max_concurrent = max_concurrent
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="crawl")
+        self.futures: Dict[str, Future] = {}
+        self.cancel_events: Dict[str, threading.Event] = {}
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def submit(self, job_id: str, job: Callable[..., None], *args) -> Future:
+        cancel_event = threading.Event()
+
+        def run():
+            with self.lock:
+                self.running.add(job_id)
+            try:
+                job(*args, cancel_event=cancel_event)
+            except Exception as e:
+                logging.error(f"Crawl job {job_id} failed: {e}")
+            finally:
+                with self.lock:
+                    self.running.discard(job_id)
+                    self.futures.pop(job_id, None)
+                    self.cancel_events.pop(job_id, None)
+
+        with self.lock:
+            self.cancel_events[job_id] = cancel_event
+            future = self.executor.submit(run)
+            self.futures[job_id] = future
+        return future
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        with self.lock:
+            future = self.futures.get(job_id)
+            if future is None:
+                return None
+            if job_id not in self.running and future.cancel():
+                self.futures.pop(job_id, None)
+                self.cancel_events.pop(job_id, None)
+                return "dequeued"
+            self.cancel_events[job_id].set()
+            return "cancelling"
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": len(self.running),
+                "queued": len(self.futures) - len(self.running)
+            }
+
+    def close(self):
+        with self.lock:
+            for event in self.cancel_events.values():
+                event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
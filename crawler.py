@@ -1,25 +1,93 @@
-import re
+import os
 import time
 import json
-import requests
 import hashlib
+import asyncio
+import threading
+import multiprocessing
+import requests
+import httpx
+from collections import defaultdict
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-from typing import List, Dict, Set, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+from typing import List, Dict, Set, Tuple, Optional, Callable, Awaitable, AsyncIterator
 import logging
+from frontier import Frontier, CrawlCheckpoint
+from metrics import CRAWL_STAGE
+from page_parser import (
+    clean_text, extract_main_content, extract_metadata, parse_page, resolve_parser, valid_url
+)
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Parse workers are started once per process and shared by every crawl. They come from a
+# forkserver (or spawn) context, so they never inherit the API's threads, locks or loaded models.
+parse_pools: Dict[int, ProcessPoolExecutor] = {}
+parse_pools_lock = threading.Lock()
+
+def get_parse_pool(workers: int) -> ProcessPoolExecutor:
+    with parse_pools_lock:
+        pool = parse_pools.get(workers)
+        if pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            parse_pools[workers] = pool
+        return pool
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
 class Crawler:
-    def __init__(self, user_agent: str = "KoalaBot/1.0"):
+    def __init__(self, user_agent: str = "KoalaBot/1.0", parser: str = "html.parser",
+                 parse_workers: Optional[int] = None, cancel_event: Optional[threading.Event] = None,
+                 validators: Optional[Dict[str, Dict]] = None):
         self.visited: Set[str] = set()
-        self.to_visit: List[Tuple[str, int]] = []
+        self.to_visit = Frontier()
         self.data = []
         self.seen_content_hashes: Set[str] = set()
         self.headers = {"User-Agent": user_agent}
+        self.parser = resolve_parser(parser)
+        self.parse_workers = (os.cpu_count() or 1) if parse_workers is None else parse_workers
+        self.parse_pool: Optional[ProcessPoolExecutor] = None
+        self.cancel_event = cancel_event or threading.Event()
+        # Validators from the previous crawl, keyed by URL; pages fetched this time record
+        # theirs in new_validators for the caller to persist.
+        self.validators: Dict[str, Dict] = validators or {}
+        self.new_validators: Dict[str, Dict] = {}
+        self.recrawl_stats = {
+            "fetched": 0,
+            "not_modified": 0,
+            "unchanged_body": 0,
+            "bytes_downloaded": 0,
+            "bytes_saved": 0
+        }
+        
+    def cancel(self):
+        self.cancel_event.set()
+        
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
         
     def is_allowed(self, url: str, robots_rules: Dict[str, List[str]]) -> bool:
         domain = urlparse(url).netloc
@@ -50,181 +118,362 @@ class Crawler:
         return disallowed
         
     def valid_url(self, url: str, domain: str) -> bool:
-        parsed = urlparse(url)
-        
-        if not (parsed.scheme in {'http', 'https'} and parsed.netloc):
-            return False
-            
-        if domain and domain not in parsed.netloc:
-            return False
-            
-        skip_extensions = {'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.css', '.js', '.xml', '.zip'}
-        if any(parsed.path.lower().endswith(ext) for ext in skip_extensions):
-            return False
-            
-        skip_patterns = ['#', 'javascript:', 'mailto:', 'tel:']
-        if any(pattern in url.lower() for pattern in skip_patterns):
-            return False
-            
-        return True
+        return valid_url(url, domain)
                 
     def clean_text(self, text: str) -> str:
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'[^\w\s\.\,\!\?\;\:\-\(\)]', ' ', text)
-        text = text.strip()
-        return text
+        return clean_text(text)
         
     def extract_main_content(self, soup: BeautifulSoup) -> str:
-        for script in soup(["script", "style", "nav", "header", "footer", "aside"]):
-            script.decompose()
-            
-        main_content = ""
-        
-        content_selectors = [
-            'main', 'article', '.content', '#content', '.post', '.entry',
-            '.article-body', '.post-content', '.entry-content'
-        ]
-        
-        for selector in content_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                main_content = content_elem.get_text(separator='\n', strip=True)
-                break
-                
-        if not main_content:
-            for elem in soup.find_all(['nav', 'sidebar', 'menu', 'footer', 'header']):
-                elem.decompose()
-            main_content = soup.get_text(separator='\n', strip=True)
-            
-        return self.clean_text(main_content)
+        return extract_main_content(soup)
         
     def extract_metadata(self, soup: BeautifulSoup, url: str) -> Dict:
-        metadata = {
-            "url": url,
-            "title": "",
-            "description": "",
-            "keywords": [],
-            "last_modified": None
-        }
+        return extract_metadata(soup, url)
+    
+    def _is_html(self, url: str, content_type: str) -> bool:
+        content_type = content_type.lower()
+        if 'text/html' not in content_type:
+            logging.info(f"Skipping {url}: not HTML content ({content_type})")
+            return False
+        return True
+    
+    def _accept_page(self, url: str, parsed: Tuple[Optional[Dict], int, str, List[str]],
+                     validators: Optional[Dict] = None) -> Tuple[Optional[Dict], List[str]]:
+        metadata, word_count, content_hash, links = parsed
+        if metadata is None:
+            logging.info(f"Skipping {url}: content too short ({word_count} words)")
+            return None, []
         
-        title_tag = soup.find('title')
-        if title_tag:
-            metadata["title"] = self.clean_text(title_tag.get_text())
-            
-        meta_desc = soup.find('meta', attrs={"name": "description"}) or \
-                   soup.find('meta', attrs={"property": "og:description"})
-        if meta_desc and meta_desc.get('content'):
-            metadata["description"] = self.clean_text(meta_desc['content'])
-            
-        meta_keywords = soup.find('meta', attrs={"name": "keywords"})
-        if meta_keywords and meta_keywords.get('content'):
-            metadata["keywords"] = [k.strip() for k in meta_keywords['content'].split(',')]
+        if content_hash in self.seen_content_hashes:
+            logging.info(f"Skipping {url}: similar content detected")
+            return None, []
             
-        return metadata
+        self.seen_content_hashes.add(content_hash)
+        if validators is not None:
+            metadata["last_modified"] = validators.get("last_modified")
+            self.new_validators[url] = dict(validators, content_hash=content_hash, links=links)
+        
+        new_urls = list({link for link in links if link not in self.visited})
+        return metadata, new_urls
+    
+    def process_page(self, url: str, content_type: str, html: str,
+                     validators: Optional[Dict] = None) -> Tuple[Optional[Dict], List[str]]:
+        if not self._is_html(url, content_type):
+            return None, []
+        with CRAWL_STAGE.time(stage="parse"):
+            parsed = parse_page(url, html, self.parser)
+        with CRAWL_STAGE.time(stage="dedup"):
+            return self._accept_page(url, parsed, validators)
+    
+    async def process_page_async(self, url: str, content_type: str, html: str,
+                                 validators: Optional[Dict] = None) -> Tuple[Optional[Dict], List[str]]:
+        if not self._is_html(url, content_type):
+            return None, []
+        with CRAWL_STAGE.time(stage="parse"):
+            if self.parse_pool is None:
+                parsed = parse_page(url, html, self.parser)
+            else:
+                parsed = await asyncio.get_running_loop().run_in_executor(
+                    self.parse_pool, parse_page, url, html, self.parser
+                )
+        with CRAWL_STAGE.time(stage="dedup"):
+            return self._accept_page(url, parsed, validators)
+    
+    def _conditional_headers(self, url: str) -> Dict[str, str]:
+        previous = self.validators.get(url)
+        headers = {}
+        if previous:
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+        return headers
+    
+    # Returns the validators for a fresh response, or None when the page is unchanged since
+    # the last crawl (a 304, or a 200 with an identical body) and needs no parsing.
+    def _check_response(self, url: str, status_code: int, headers, body: bytes) -> Optional[Dict]:
+        previous = self.validators.get(url)
+        if status_code == 304 and previous:
+            self.recrawl_stats["not_modified"] += 1
+            self.recrawl_stats["bytes_saved"] += previous.get("size", 0)
+            return None
+        
+        body_hash = hashlib.sha1(body).hexdigest()
+        self.recrawl_stats["fetched"] += 1
+        self.recrawl_stats["bytes_downloaded"] += len(body)
+        if previous and previous.get("body_hash") == body_hash:
+            self.recrawl_stats["unchanged_body"] += 1
+            return None
+        return {
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "body_hash": body_hash,
+            "size": len(body)
+        }
+    
+    # Unchanged pages keep their stored document and outlinks; the marker tells ingestion
+    # to leave them alone rather than treat them as removed.
+    def _unchanged_page(self, url: str) -> Tuple[Dict, List[str]]:
+        previous = self.validators[url]
+        if previous.get("content_hash"):
+            self.seen_content_hashes.add(previous["content_hash"])
+        logging.info(f"Unchanged since last crawl: {url}")
+        return {"url": url, "unchanged": True}, \
+            list({link for link in previous.get("links", []) if link not in self.visited})
     
     def crawl_page(self, url: str, robots_rules: Dict[str, List[str]]) -> Tuple[Optional[Dict], List[str]]:
         if not self.is_allowed(url, robots_rules):
             logging.info(f"Robots.txt disallows crawling: {url}")
             return None, []
         
-        new_urls = []
         try:
-            response = requests.get(url, headers=self.headers, timeout=15)
-            response.raise_for_status()
+            with CRAWL_STAGE.time(stage="fetch"):
+                response = requests.get(url, headers=dict(self.headers, **self._conditional_headers(url)),
+                                        timeout=15)
+            if response.status_code != 304:
+                response.raise_for_status()
             
-            content_type = response.headers.get('content-type', '').lower()
-            if 'text/html' not in content_type:
-                logging.info(f"Skipping {url}: not HTML content ({content_type})")
-                return None, []
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            content = self.extract_main_content(soup)
-            
-            word_count = len(content.split())
-            if not content or word_count < 10:  # Reduced from 20 to 10
-                logging.info(f"Skipping {url}: content too short ({word_count} words)")
-                return None, []
-                
-            content_sample = content[:500] if len(content) > 500 else content
-            content_hash = hashlib.md5(content_sample.encode()).hexdigest()
-            
-            if content_hash in self.seen_content_hashes:
-                logging.info(f"Skipping {url}: similar content detected")
-                return None, []
-                
-            self.seen_content_hashes.add(content_hash)
+            validators = self._check_response(url, response.status_code, response.headers, response.content)
+            if validators is None:
+                return self._unchanged_page(url)
+            return self.process_page(url, response.headers.get('content-type', ''), response.text, validators)
             
-            metadata = self.extract_metadata(soup, url)
-            metadata["content"] = content
-            metadata["word_count"] = word_count
+        except requests.RequestException as e:
+            logging.error(f"Request error crawling {url}: {e}")
+            return None, []
+        except Exception as e:
+            logging.error(f"Error crawling {url}: {e}")
+            return None, []
             
-            domain = urlparse(url).netloc
-            for link_tag in soup.find_all('a', href=True):
-                href = link_tag.get('href', '').strip()
-                if not href:
-                    continue
-                    
-                full_url = urljoin(url, href)
-                
-                parsed = urlparse(full_url)
-                clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
-                if parsed.query:
-                    clean_url += f"?{parsed.query}"
-                
-                if (self.valid_url(clean_url, domain) and 
-                    clean_url not in self.visited and 
-                    clean_url != url):
-                    new_urls.append(clean_url)
-                    
-            new_urls = list(set(new_urls))
+    async def crawl_page_async(self, client: httpx.AsyncClient, url: str,
+                               robots_rules: Dict[str, List[str]]) -> Tuple[Optional[Dict], List[str]]:
+        if not self.is_allowed(url, robots_rules):
+            logging.info(f"Robots.txt disallows crawling: {url}")
+            return None, []
+        
+        try:
+            with CRAWL_STAGE.time(stage="fetch"):
+                response = await client.get(url, headers=self._conditional_headers(url))
+            if response.status_code != 304:
+                response.raise_for_status()
             
-            return metadata, new_urls
+            validators = self._check_response(url, response.status_code, response.headers, response.content)
+            if validators is None:
+                return self._unchanged_page(url)
+            return await self.process_page_async(url, response.headers.get('content-type', ''), response.text,
+                                                 validators)
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logging.error(f"Request error crawling {url}: {e}")
             return None, []
         except Exception as e:
             logging.error(f"Error crawling {url}: {e}")
             return None, []
             
-    def crawl(self, seed_url: str, max_pages: int = 50, max_depth: int = 2) -> List[Dict]:
-        self.to_visit = [(seed_url, 0)]
+    def _open_frontier(self, seed_url: str, checkpoint_path: Optional[str]) -> CrawlCheckpoint:
+        checkpoint = CrawlCheckpoint(checkpoint_path)
+        self.to_visit = Frontier()
+        restored = checkpoint.restore(seed_url, self.to_visit)
+        self.visited = checkpoint.seen
+        
+        if restored:
+            self.data, self.seen_content_hashes = restored
+        else:
+            self.data = []
+            self.to_visit.push(seed_url, 0)
+        return checkpoint
+        
+    def _enqueue_links(self, new_urls: List[str], depth: int, max_depth: int):
+        if depth < max_depth:
+            for new_url in new_urls[:10]:
+                if new_url not in self.visited:
+                    self.to_visit.push(new_url, depth + 1)
+        
+    async def crawl_async(self, seed_url: str, max_pages: int = 50, max_depth: int = 2,
+                          concurrency: int = 10, per_host_concurrency: int = 4,
+                          requests_per_second: float = 2.0, burst: int = 4,
+                          checkpoint_path: Optional[str] = None, checkpoint_every: int = 25,
+                          on_progress: Optional[Callable[[int, int], None]] = None,
+                          on_page: Optional[Callable[[Dict], Awaitable]] = None) -> List[Dict]:
+        domain = urlparse(seed_url).netloc
+        
+        robots_rules = {domain: await asyncio.to_thread(self.get_robots_txt, seed_url)}
+        logging.info(f"Starting async crawl from {seed_url}")
+        logging.info(f"Max pages: {max_pages}, Max depth: {max_depth}, Concurrency: {concurrency}")
+        
+        checkpoint = self._open_frontier(seed_url, checkpoint_path)
+        # Pages restored from a checkpoint are handed over again; re-ingesting them is cheap
+        # because unchanged documents are skipped by content hash.
+        if on_page:
+            for page_data in list(self.data):
+                await on_page(page_data)
+        last_checkpoint = len(self.data)
+        in_flight: Dict[str, int] = {}
+        ready = asyncio.Condition()
+        host_slots: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(per_host_concurrency))
+        host_buckets: Dict[str, TokenBucket] = defaultdict(lambda: TokenBucket(requests_per_second, burst))
+        
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        # Fetching stays on the event loop; parsing and extraction run in worker processes.
+        if self.parse_workers > 0:
+            self.parse_pool = get_parse_pool(self.parse_workers)
+        completed = False
+        try:
+            async with httpx.AsyncClient(headers=self.headers, timeout=15, limits=limits,
+                                         follow_redirects=True) as client:
+                
+                async def worker():
+                    nonlocal last_checkpoint
+                    while True:
+                        async with ready:
+                            while not self.to_visit and in_flight and len(self.data) < max_pages \
+                                    and not self.cancelled:
+                                await ready.wait()
+                            if not self.to_visit or len(self.data) >= max_pages or self.cancelled:
+                                ready.notify_all()
+                                return
+                            url, depth = self.to_visit.pop()
+                            if url in self.visited or depth > max_depth:
+                                continue
+                            self.visited.add(url)
+                            in_flight[url] = depth
+                        
+                        try:
+                            host = urlparse(url).netloc
+                            async with host_slots[host]:
+                                await host_buckets[host].acquire()
+                                logging.info(f"Crawling (depth {depth}): {url}")
+                                page_data, new_urls = await self.crawl_page_async(client, url, robots_rules)
+                            
+                            if page_data and len(self.data) < max_pages:
+                                self.data.append(page_data)
+                                logging.info(f"✓ Successfully crawled [{len(self.data)}/{max_pages}]: {url} ({'unchanged' if page_data.get('unchanged') else str(page_data['word_count']) + ' words'})")
+                                self._enqueue_links(new_urls, depth, max_depth)
+                                # Awaiting a slow consumer holds this worker, which is the backpressure.
+                                if on_page:
+                                    await on_page(page_data)
+                            elif not page_data:
+                                logging.info(f"✗ No data extracted from {url}")
+                        finally:
+                            async with ready:
+                                del in_flight[url]
+                                if len(self.data) - last_checkpoint >= checkpoint_every:
+                                    checkpoint.save(self.to_visit, self.data, self.seen_content_hashes,
+                                                    in_flight.items())
+                                    last_checkpoint = len(self.data)
+                                if on_progress:
+                                    on_progress(len(self.data), len(self.to_visit))
+                                ready.notify_all()
+                
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+            # A cancelled crawl keeps its checkpoint so it can be resumed later.
+            completed = not self.cancelled
+        finally:
+            if not completed:
+                checkpoint.save(self.to_visit, self.data, self.seen_content_hashes, in_flight.items())
+            checkpoint.close(completed=completed)
+            self.parse_pool = None
+        
+        if self.cancelled:
+            logging.info(f"Crawling cancelled after {len(self.data)} pages")
+        else:
+            logging.info(f"Crawling completed. Successfully crawled {len(self.data)} pages")
+        return self.data
+        
+    # Yields pages as they are crawled. The bounded queue between the crawl workers and the
+    # consumer makes the workers wait once queue_size pages are pending.
+    # Yields pages in lists of up to batch_size. A partial list is yielded once its first page
+    # has waited flush_seconds, whether or not another page arrives, and the rest at the end.
+    async def crawl_stream(self, seed_url: str, queue_size: int = 64, batch_size: int = 1,
+                           flush_seconds: Optional[float] = None, **options) -> AsyncIterator[List[Dict]]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        finished = object()
+        consuming = True
+        
+        async def produce():
+            try:
+                await self.crawl_async(seed_url, on_page=queue.put, **options)
+            finally:
+                if consuming:
+                    await queue.put(finished)
+        
+        producer = asyncio.create_task(produce())
+        try:
+            batch: List[Dict] = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    page_data = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield batch
+                    batch, deadline = [], None
+                    continue
+                if page_data is finished:
+                    break
+                if not batch and flush_seconds is not None:
+                    deadline = time.monotonic() + flush_seconds
+                batch.append(page_data)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch, deadline = [], None
+            await producer
+            if batch:
+                yield batch
+        finally:
+            consuming = False
+            if not producer.done():
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+        
+    def crawl(self, seed_url: str, max_pages: int = 50, max_depth: int = 2,
+              checkpoint_path: Optional[str] = None, checkpoint_every: int = 25,
+              on_progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
         domain = urlparse(seed_url).netloc
         
         robots_rules = {domain: self.get_robots_txt(seed_url)}
         logging.info(f"Starting crawl from {seed_url}")
         logging.info(f"Max pages: {max_pages}, Max depth: {max_depth}")
         
-        pages_crawled = 0
-        
-        while self.to_visit and pages_crawled < max_pages:
-            url, depth = self.to_visit.pop(0)
-            
-            if url in self.visited or depth > max_depth:
-                continue
-            
-            self.visited.add(url)
-            
-            logging.info(f"Crawling [{pages_crawled + 1}/{max_pages}] (depth {depth}): {url}")
-            
-            page_data, new_urls = self.crawl_page(url, robots_rules)
-            
-            if page_data:
-                self.data.append(page_data)
-                pages_crawled += 1
-                logging.info(f"✓ Successfully crawled: {url} ({page_data['word_count']} words)")
+        checkpoint = self._open_frontier(seed_url, checkpoint_path)
+        last_checkpoint = len(self.data)
+        completed = False
+        try:
+            while self.to_visit and len(self.data) < max_pages and not self.cancelled:
+                url, depth = self.to_visit.pop()
                 
-                if depth < max_depth:
-                    for new_url in new_urls[:10]:
-                        if new_url not in self.visited:
-                            self.to_visit.append((new_url, depth + 1))
-            else:
-                logging.info(f"✗ No data extracted from {url}")
-            
-            time.sleep(0.5)
+                if url in self.visited or depth > max_depth:
+                    continue
+                
+                self.visited.add(url)
+                
+                logging.info(f"Crawling [{len(self.data) + 1}/{max_pages}] (depth {depth}): {url}")
+                
+                page_data, new_urls = self.crawl_page(url, robots_rules)
+                
+                if page_data:
+                    self.data.append(page_data)
+                    logging.info(f"✓ Successfully crawled: {url} ({'unchanged' if page_data.get('unchanged') else str(page_data['word_count']) + ' words'})")
+                    self._enqueue_links(new_urls, depth, max_depth)
+                else:
+                    logging.info(f"✗ No data extracted from {url}")
+                
+                if len(self.data) - last_checkpoint >= checkpoint_every:
+                    checkpoint.save(self.to_visit, self.data, self.seen_content_hashes)
+                    last_checkpoint = len(self.data)
+                if on_progress:
+                    on_progress(len(self.data), len(self.to_visit))
+                
+                time.sleep(0.5)
+            completed = not self.cancelled
+        finally:
+            if not completed:
+                checkpoint.save(self.to_visit, self.data, self.seen_content_hashes)
+            checkpoint.close(completed=completed)
                 
-        logging.info(f"Crawling completed. Successfully crawled {len(self.data)} pages")
+        if self.cancelled:
+            logging.info(f"Crawling cancelled after {len(self.data)} pages")
+        else:
+            logging.info(f"Crawling completed. Successfully crawled {len(self.data)} pages")
         return self.data
         
     def save_data(self, filename: str = 'prepared_data.json'):
@@ -0,0 +1,544 @@
+import os
+import re
+import json
+import mmap
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from typing import List, Dict, Optional, Iterable, Iterator, Set, Tuple
+
+def url_to_id(url: str) -> int:
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & 0x7FFFFFFFFFFFFFFF
+
+def passage_id(doc_id: int, number: int) -> int:
+    digest = hashlib.blake2b(f"{doc_id}:{number}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & 0x7FFFFFFFFFFFFFFF
+
+def normalize_domain(domain: str) -> str:
+    domain = domain.strip().lower()
+    if "://" in domain:
+        domain = urlparse(domain).netloc
+    domain = domain.split("/")[0]
+    return domain[4:] if domain.startswith("www.") else domain
+
+def host_matches(url: str, domain: str) -> bool:
+    host = urlparse(url).netloc.lower()
+    domain = normalize_domain(domain)
+    return host == domain or host.endswith("." + domain)
+
+# Hosts are also stored reversed with a trailing dot ("moc.elpmaxe." for example.com), so a
+# domain and all of its subdomains form one contiguous key range instead of a suffix LIKE scan.
+def reversed_host(host: str) -> str:
+    return host[::-1] + "."
+
+def reversed_host_range(domain: str) -> Tuple[str, str]:
+    prefix = reversed_host(normalize_domain(domain))
+    return prefix, prefix[:-1] + "/"
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def normalize_entry(entry) -> Dict:
+    if isinstance(entry, list):
+        return {"url": entry[0], "content": entry[1], "title": "", "description": ""}
+    return entry
+
+CHAR_INDEX_STEP = 1024
+
+# A record is a JSON header line (the entry without its content, plus the content's byte and
+# character lengths) followed by the content as raw UTF-8. For non-ASCII text the char index
+# holds the byte position of every CHAR_INDEX_STEP-th character.
+def encode_record(entry: Dict) -> Tuple[bytes, Optional[bytes]]:
+    content = entry.get("content", "")
+    data = content.encode('utf-8')
+    header = {key: value for key, value in entry.items() if key != "content"}
+    header.update(content_bytes=len(data), content_chars=len(content))
+    record = json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n' + data + b'\n'
+    if len(data) == len(content):
+        return record, None
+    positions, position = array('I'), 0
+    for start in range(0, len(content), CHAR_INDEX_STEP):
+        positions.append(position)
+        position += len(content[start:start + CHAR_INDEX_STEP].encode('utf-8'))
+    return record, positions.tobytes()
+
+# Page text read in place from a mapped segment. Slicing, find and rfind decode only the
+# characters asked for, so a snippet never decodes the whole page. Only valid while the
+# store lock is held (see DocumentStore.open_text).
+class StoredText:
+    def __init__(self, mapped: mmap.mmap, start: int, size: int, chars: int, char_index: Optional[array]):
+        self.mapped = mapped
+        self.start = start
+        self.size = size
+        self.chars = chars
+        self.char_index = char_index
+
+    def __len__(self) -> int:
+        return self.chars
+
+    def _decode(self, start: int, end: int) -> str:
+        start, end = max(0, start), min(self.chars, end)
+        if end <= start:
+            return ""
+        if self.size == self.chars:
+            return self.mapped[self.start + start:self.start + end].decode('utf-8')
+        block = start // CHAR_INDEX_STEP
+        base = block * CHAR_INDEX_STEP
+        begin = self.start + self.char_index[block]
+        # A character is at most 4 bytes; one cut off at the end of the read lies past `end`.
+        data = self.mapped[begin:min(self.start + self.size, begin + 4 * (end - base))]
+        return data.decode('utf-8', errors='ignore')[start - base:end - base]
+
+    def __getitem__(self, key: slice) -> str:
+        start, end, _ = key.indices(self.chars)
+        return self._decode(start, end)
+
+    def __str__(self) -> str:
+        return self._decode(0, self.chars)
+
+    def find(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        start, end, _ = slice(start, end).indices(self.chars)
+        index = self._decode(start, end).find(sub)
+        return index if index == -1 else index + start
+
+    def rfind(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        start, end, _ = slice(start, end).indices(self.chars)
+        index = self._decode(start, end).rfind(sub)
+        return index if index == -1 else index + start
+
+# Pages are appended as records (see encode_record) to size-capped segment files. A SQLite
+# table maps each document to (segment, offset, length) plus the small
+# fields needed to display a hit, so page text is only read (via mmap)
+# for the documents actually shown.
+class DocumentStore:
+    def __init__(self, path: str = 'documents', segment_max_bytes: int = 64 * 1024 * 1024):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.RLock()
+        self.maps: Dict[int, mmap.mmap] = {}
+        # Segments still referenced by an open pending_* scan; compaction leaves them in place.
+        self.pins: Counter = Counter()
+
+        self.conn = sqlite3.connect(os.path.join(path, 'index.db'), check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                embedded_hash TEXT,
+                title TEXT,
+                description TEXT,
+                domain TEXT,
+                lexical_hash TEXT,
+                rhost TEXT,
+                char_index BLOB
+            );
+            CREATE INDEX IF NOT EXISTS docs_url ON docs (url);
+            CREATE INDEX IF NOT EXISTS docs_pending ON docs (embedded_hash, hash);
+            CREATE TABLE IF NOT EXISTS passages (
+                passage_id INTEGER PRIMARY KEY,
+                doc_id INTEGER NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS passages_doc ON passages (doc_id);
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                content_hash TEXT,
+                size INTEGER,
+                links TEXT
+            );
+        """)
+
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(docs)")}
+        if "domain" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE docs ADD COLUMN domain TEXT")
+                self.conn.executemany("UPDATE docs SET domain = ? WHERE doc_id = ?", [
+                    (urlparse(url).netloc.lower(), doc_id)
+                    for doc_id, url in self.conn.execute("SELECT doc_id, url FROM docs").fetchall()
+                ])
+        if "lexical_hash" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE docs ADD COLUMN lexical_hash TEXT")
+        if "rhost" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE docs ADD COLUMN rhost TEXT")
+                self.conn.executemany("UPDATE docs SET rhost = ? WHERE doc_id = ?", [
+                    (reversed_host(domain or ""), doc_id)
+                    for doc_id, domain in self.conn.execute("SELECT doc_id, domain FROM docs").fetchall()
+                ])
+        if "char_index" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE docs ADD COLUMN char_index BLOB")
+        self.conn.execute("DROP INDEX IF EXISTS docs_domain")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS docs_rhost ON docs (rhost)")
+
+        segments = self._segments()
+        self.active_segment = segments[-1] if segments else 1
+        self.count = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def _segments(self) -> List[int]:
+        names = (re.match(r'segment-(\d+)\.jsonl$', name) for name in os.listdir(self.path))
+        return sorted(int(match.group(1)) for match in names if match)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"segment-{segment:06d}.jsonl")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, doc_id: int) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM docs WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        mapped = self.maps.get(segment)
+        if mapped is None or end > len(mapped):
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment), 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = mapped
+        return mapped
+
+    def _append(self, records: List[bytes]) -> List[Tuple[int, int, int]]:
+        locations = []
+        position = 0
+        while position < len(records):
+            path = self._segment_path(self.active_segment)
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset >= self.segment_max_bytes:
+                self.active_segment += 1
+                continue
+            with open(path, 'ab') as file:
+                while position < len(records) and offset < self.segment_max_bytes:
+                    record = records[position]
+                    file.write(record)
+                    locations.append((self.active_segment, offset, len(record)))
+                    offset += len(record)
+                    position += 1
+                file.flush()
+                os.fsync(file.fileno())
+        return locations
+
+    def put_many(self, entries: Iterable[Dict]) -> Dict[str, int]:
+        with self.lock:
+            records, rows = [], []
+            unchanged = 0
+            for entry in entries:
+                entry = normalize_entry(entry)
+                url = entry.get("url", "")
+                doc_id = url_to_id(url)
+                doc_hash = content_hash(entry.get("content", ""))
+                title, description = entry.get("title", ""), entry.get("description", "")
+
+                existing = self.conn.execute(
+                    "SELECT hash, title, description FROM docs WHERE doc_id = ?", (doc_id,)
+                ).fetchone()
+                if existing == (doc_hash, title, description):
+                    unchanged += 1
+                    continue
+
+                record, char_index = encode_record(entry)
+                records.append(record)
+                rows.append((doc_id, url, doc_hash, title, description, urlparse(url).netloc.lower(), char_index))
+
+            locations = self._append(records) if records else []
+            with self.conn:
+                self.conn.executemany("""
+                    INSERT INTO docs (doc_id, url, segment, offset, length, hash, title, description, domain, rhost,
+                                      char_index)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(doc_id) DO UPDATE SET
+                        url = excluded.url, segment = excluded.segment, offset = excluded.offset,
+                        length = excluded.length, hash = excluded.hash,
+                        title = excluded.title, description = excluded.description,
+                        domain = excluded.domain, rhost = excluded.rhost, char_index = excluded.char_index
+                """, [(doc_id, url, segment, offset, length, doc_hash, title, description, host, reversed_host(host),
+                       char_index)
+                      for (doc_id, url, doc_hash, title, description, host, char_index), (segment, offset, length)
+                      in zip(rows, locations)])
+            self.count = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            return {"written": len(records), "unchanged": unchanged}
+
+    def delete(self, urls: Iterable[str]) -> List[int]:
+        urls = list(urls)
+        with self.lock:
+            doc_ids = [doc_id for doc_id in {url_to_id(url) for url in urls} if doc_id in self]
+            with self.conn:
+                self.conn.executemany("DELETE FROM validators WHERE url = ?", [(url,) for url in urls])
+            if not doc_ids:
+                return []
+            with self.conn:
+                self.conn.executemany("DELETE FROM docs WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+            self.count -= len(doc_ids)
+            return doc_ids
+
+    # Records written before the header/content split are a single JSON line.
+    def _read_header(self, segment: int, offset: int, length: int) -> Tuple[mmap.mmap, Dict, int]:
+        mapped = self._map(segment, offset + length)
+        newline = mapped.find(b'\n', offset, offset + length)
+        return mapped, json.loads(mapped[offset:newline]), newline + 1
+
+    def _read(self, segment: int, offset: int, length: int) -> Dict:
+        with self.lock:
+            mapped, entry, start = self._read_header(segment, offset, length)
+            if "content_bytes" in entry:
+                size = entry.pop("content_bytes")
+                entry.pop("content_chars")
+                entry["content"] = mapped[start:start + size].decode('utf-8')
+            return entry
+
+    def get_many(self, doc_ids: Iterable[int]) -> Dict[int, Dict]:
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        found = {}
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT doc_id, url, hash, title, description FROM docs WHERE doc_id IN ({placeholders})", chunk
+                ).fetchall()
+            for doc_id, url, doc_hash, title, description in rows:
+                found[doc_id] = {
+                    "url": url,
+                    "hash": doc_hash,
+                    "metadata": {"title": title or "", "description": description or ""}
+                }
+        return found
+
+    def get_document(self, doc_id: int) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT segment, offset, length FROM docs WHERE doc_id = ?", (int(doc_id),)
+            ).fetchone()
+            return self._read(*row) if row else None
+
+    def get_text(self, doc_id: int) -> str:
+        document = self.get_document(doc_id)
+        return document.get("content", "") if document else ""
+
+    # Yields the page text as a StoredText ("" for a missing document) with the store lock held,
+    # so its segment stays mapped and in place while windows are read from it.
+    @contextmanager
+    def open_text(self, doc_id: int) -> Iterator:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT segment, offset, length, char_index FROM docs WHERE doc_id = ?", (int(doc_id),)
+            ).fetchone()
+            if row is None:
+                yield ""
+                return
+            segment, offset, length, char_index = row
+            mapped, entry, start = self._read_header(segment, offset, length)
+            if "content_bytes" not in entry:
+                yield entry.get("content", "")
+            elif entry["content_bytes"] != entry["content_chars"] and char_index is None:
+                yield mapped[start:start + entry["content_bytes"]].decode('utf-8')
+            else:
+                yield StoredText(mapped, start, entry["content_bytes"], entry["content_chars"],
+                                 array('I', char_index) if char_index is not None else None)
+
+    def ids(self) -> List[int]:
+        with self.lock:
+            return [doc_id for (doc_id,) in self.conn.execute("SELECT doc_id FROM docs")]
+
+    def urls_with_prefix(self, prefix: str) -> List[str]:
+        with self.lock:
+            return [url for (url,) in self.conn.execute(
+                "SELECT url FROM docs WHERE url >= ? AND url < ?", (prefix, prefix + "\U0010ffff")
+            )]
+
+    # HTTP validators (ETag, Last-Modified, body and content hashes, outlinks) from the last
+    # fetch of each page, so a recrawl can send conditional requests and skip unchanged pages.
+    def validators_with_prefix(self, prefix: str) -> Dict[str, Dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT url, etag, last_modified, body_hash, content_hash, size, links FROM validators "
+                "WHERE url >= ? AND url < ?", (prefix, prefix + "\U0010ffff")
+            ).fetchall()
+        return {url: {
+            "etag": etag,
+            "last_modified": last_modified,
+            "body_hash": body_hash,
+            "content_hash": content_hash,
+            "size": size or 0,
+            "links": json.loads(links) if links else []
+        } for url, etag, last_modified, body_hash, content_hash, size, links in rows}
+
+    def put_validators(self, validators: Dict[str, Dict]):
+        with self.lock, self.conn:
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO validators (url, etag, last_modified, body_hash, content_hash, size, links)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(url, v.get("etag"), v.get("last_modified"), v.get("body_hash"), v.get("content_hash"),
+                   v.get("size", 0), json.dumps(v.get("links", [])))
+                  for url, v in validators.items()])
+
+    # With doc_ids, only those documents are checked, so a streamed batch does not scan the whole table.
+    def _pending_rows(self, hash_column: str, doc_ids: Optional[Iterable[int]]) -> List[tuple]:
+        sql = (f"SELECT doc_id, hash, segment, offset, length FROM docs "
+               f"WHERE ({hash_column} IS NULL OR {hash_column} != hash)")
+        if doc_ids is not None:
+            return self._select_in(sql + " AND doc_id IN ({})", [int(d) for d in doc_ids])
+        with self.lock:
+            return self.conn.execute(sql).fetchall()
+
+    # The segments of the fetched rows are pinned until the scan finishes or is closed, so
+    # compaction cannot remove a record the scan has yet to read.
+    def _scan_pending(self, hash_column: str, batch_size: int,
+                      doc_ids: Optional[Iterable[int]]) -> Iterator[List[Tuple[int, str, Dict]]]:
+        with self.lock:
+            rows = self._pending_rows(hash_column, doc_ids)
+            segments = list({row[2] for row in rows})
+            self.pins.update(segments)
+        try:
+            for start in range(0, len(rows), batch_size):
+                yield [
+                    (doc_id, doc_hash, self._read(segment, offset, length))
+                    for doc_id, doc_hash, segment, offset, length in rows[start:start + batch_size]
+                ]
+        finally:
+            with self.lock:
+                self.pins.subtract(segments)
+
+    def present_ids(self, doc_ids: Iterable[int]) -> Set[int]:
+        return {doc_id for (doc_id,) in self._select_in(
+            "SELECT doc_id FROM docs WHERE doc_id IN ({})", [int(d) for d in doc_ids]
+        )}
+
+    def pending_embeddings(self, batch_size: int = 256,
+                           doc_ids: Optional[Iterable[int]] = None) -> Iterator[List[Tuple[int, str, str]]]:
+        for batch in self._scan_pending("embedded_hash", batch_size, doc_ids):
+            yield [(doc_id, doc_hash, entry.get("content", "")) for doc_id, doc_hash, entry in batch]
+
+    def mark_embedded(self, items: Iterable[Tuple[int, str]]):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE docs SET embedded_hash = ? WHERE doc_id = ?",
+                [(doc_hash, doc_id) for doc_id, doc_hash in items]
+            )
+
+    def pending_lexical(self, batch_size: int = 500,
+                        doc_ids: Optional[Iterable[int]] = None) -> Iterator[List[Tuple[int, str, Dict]]]:
+        return self._scan_pending("lexical_hash", batch_size, doc_ids)
+
+    def mark_lexical(self, items: Iterable[Tuple[int, str]]):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE docs SET lexical_hash = ? WHERE doc_id = ?",
+                [(doc_hash, doc_id) for doc_id, doc_hash in items]
+            )
+
+    def doc_ids_for_domain(self, domain: str) -> List[int]:
+        with self.lock:
+            return [doc_id for (doc_id,) in self.conn.execute(
+                "SELECT doc_id FROM docs WHERE rhost >= ? AND rhost < ?", reversed_host_range(domain)
+            )]
+
+    def clear_embedded(self):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE docs SET embedded_hash = NULL")
+            self.conn.execute("DELETE FROM passages")
+
+    def _select_in(self, sql: str, values: List[int]) -> List[tuple]:
+        rows = []
+        with self.lock:
+            for start in range(0, len(values), 500):
+                chunk = values[start:start + 500]
+                rows.extend(self.conn.execute(sql.format(",".join("?" * len(chunk))), chunk).fetchall())
+        return rows
+
+    def passage_ids(self) -> List[int]:
+        with self.lock:
+            return [pid for (pid,) in self.conn.execute("SELECT passage_id FROM passages")]
+
+    def passage_ids_for(self, doc_ids: Iterable[int]) -> List[int]:
+        return [pid for (pid,) in self._select_in(
+            "SELECT passage_id FROM passages WHERE doc_id IN ({})", [int(d) for d in doc_ids]
+        )]
+
+    def get_passages(self, passage_ids: Iterable[int]) -> Dict[int, Tuple[int, int, int]]:
+        return {pid: (doc_id, start, end) for pid, doc_id, start, end in self._select_in(
+            "SELECT passage_id, doc_id, start, end FROM passages WHERE passage_id IN ({})",
+            [int(p) for p in passage_ids]
+        )}
+
+    def replace_passages(self, doc_ids: Iterable[int], rows: Iterable[Tuple[int, int, int, int]]):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM passages WHERE doc_id = ?", [(int(d),) for d in doc_ids])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO passages (passage_id, doc_id, start, end) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def passage_ids_for_domain(self, domain: str) -> List[int]:
+        with self.lock:
+            return [pid for (pid,) in self.conn.execute(
+                "SELECT p.passage_id FROM docs d JOIN passages p ON p.doc_id = d.doc_id "
+                "WHERE d.rhost >= ? AND d.rhost < ?", reversed_host_range(domain)
+            )]
+
+    def orphan_passage_ids(self) -> List[int]:
+        with self.lock:
+            return [pid for (pid,) in self.conn.execute(
+                "SELECT passage_id FROM passages WHERE doc_id NOT IN (SELECT doc_id FROM docs)"
+            )]
+
+    def delete_passages(self, passage_ids: Iterable[int]):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM passages WHERE passage_id = ?", [(int(p),) for p in passage_ids])
+
+    def compact(self, min_dead_ratio: float = 0.5):
+        with self.lock:
+            live = dict(self.conn.execute("SELECT segment, SUM(length) FROM docs GROUP BY segment"))
+            for segment in self._segments():
+                if segment == self.active_segment or self.pins[segment] > 0:
+                    continue
+                size = os.path.getsize(self._segment_path(segment))
+                if size and live.get(segment, 0) > size * (1 - min_dead_ratio):
+                    continue
+
+                rows = self.conn.execute(
+                    "SELECT doc_id, offset, length FROM docs WHERE segment = ?", (segment,)
+                ).fetchall()
+                # Records do not depend on their position, so live ones are copied byte for byte.
+                mapped = self._map(segment, os.path.getsize(self._segment_path(segment)))
+                records = [mapped[offset:offset + length] for _, offset, length in rows]
+                locations = self._append(records) if records else []
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE docs SET segment = ?, offset = ?, length = ? WHERE doc_id = ?",
+                        [(new_segment, offset, length, doc_id)
+                         for (doc_id, _, _), (new_segment, offset, length) in zip(rows, locations)]
+                    )
+                mapped = self.maps.pop(segment, None)
+                if mapped is not None:
+                    mapped.close()
+                os.remove(self._segment_path(segment))
+                logging.info(f"Compacted document segment {segment} ({len(rows)} live records moved)")
+
+    def import_json(self, data_path: str) -> Dict[str, int]:
+        with open(data_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return self.put_many(data)
+
+    def close(self):
+        with self.lock:
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+            self.conn.close()
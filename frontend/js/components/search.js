@@ -111,13 +111,25 @@ class SearchComponent {
                 Relevance Score: ${result.score.toFixed(4)}
             </div>
             <div class="result-snippet">
-                ${Utils.sanitizeHTML(result.snippet)}
+                ${this.highlightSnippet(result.snippet, result.highlights || [])}
             </div>
         `;
 
         return card;
     }
 
+    highlightSnippet(snippet, highlights) {
+        let html = '';
+        let position = 0;
+        for (const [start, end] of highlights) {
+            if (start < position) continue;
+            html += Utils.sanitizeHTML(snippet.slice(position, start));
+            html += `<mark>${Utils.sanitizeHTML(snippet.slice(start, end))}</mark>`;
+            position = end;
+        }
+        return html + Utils.sanitizeHTML(snippet.slice(position));
+    }
+
     updatePagination(results) {
         if (results.total <= API_CONFIG.DEFAULT_PARAMS.PER_PAGE) {
             Utils.hide(this.pagination);
@@ -0,0 +1,168 @@
+import os
+import json
+import math
+import heapq
+import sqlite3
+import hashlib
+import tempfile
+import logging
+from urllib.parse import urlparse
+from typing import List, Tuple, Optional, Dict, Set, Iterable
+
+def score_url(url: str) -> float:
+    parsed = urlparse(url)
+    segments = [segment for segment in parsed.path.split('/') if segment]
+    score = -float(len(segments))
+    if parsed.query:
+        score -= 1.0
+    return score
+
+class BloomFilter:
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+# Bloom filter in memory, exact membership in SQLite on disk
+class SeenUrls:
+    def __init__(self, conn: sqlite3.Connection, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.conn = conn
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.count = 0
+        for (url,) in self.conn.execute("SELECT url FROM seen"):
+            self.bloom.add(url)
+            self.count += 1
+
+    def __contains__(self, url: str) -> bool:
+        if url not in self.bloom:
+            return False
+        return self.conn.execute("SELECT 1 FROM seen WHERE url = ?", (url,)).fetchone() is not None
+
+    def add(self, url: str):
+        if url in self:
+            return
+        self.bloom.add(url)
+        self.conn.execute("INSERT OR IGNORE INTO seen (url) VALUES (?)", (url,))
+        self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+class Frontier:
+    def __init__(self):
+        self.heap: List[Tuple[int, float, int, str]] = []
+        self.seq = 0
+
+    def push(self, url: str, depth: int, score: Optional[float] = None):
+        if score is None:
+            score = score_url(url)
+        heapq.heappush(self.heap, (depth, -score, self.seq, url))
+        self.seq += 1
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        if not self.heap:
+            return None
+        depth, _, _, url = heapq.heappop(self.heap)
+        return url, depth
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        return [(url, depth, -neg_score) for depth, neg_score, _, url in self.heap]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __bool__(self) -> bool:
+        return bool(self.heap)
+
+# Frontier, seen URLs and crawled pages for one crawl job, saved atomically in one SQLite file
+class CrawlCheckpoint:
+    def __init__(self, path: Optional[str] = None):
+        self.temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='koala-crawl-', suffix='.db')
+            os.close(fd)
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS frontier (url TEXT, depth INTEGER, score REAL, in_flight INTEGER);
+            CREATE TABLE IF NOT EXISTS pages (seq INTEGER PRIMARY KEY, page TEXT);
+        """)
+        self.pages_saved = 0
+        self.seen: Optional[SeenUrls] = None
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def restore(self, seed_url: str, frontier: Frontier) -> Optional[Tuple[List[Dict], Set[str]]]:
+        if self._get_meta("seed_url") != seed_url:
+            with self.conn:
+                for table in ("meta", "seen", "frontier", "pages"):
+                    self.conn.execute(f"DELETE FROM {table}")
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('seed_url', ?)", (seed_url,))
+            self.seen = SeenUrls(self.conn)
+            return None
+
+        with self.conn:
+            # Pages that were mid-fetch at checkpoint time go back on the frontier unseen.
+            self.conn.execute("DELETE FROM seen WHERE url IN (SELECT url FROM frontier WHERE in_flight = 1)")
+        self.seen = SeenUrls(self.conn)
+
+        for url, depth, score in self.conn.execute("SELECT url, depth, score FROM frontier"):
+            frontier.push(url, depth, score)
+        pages = [json.loads(page) for (page,) in self.conn.execute("SELECT page FROM pages ORDER BY seq")]
+        self.pages_saved = len(pages)
+        content_hashes = set(json.loads(self._get_meta("content_hashes") or "[]"))
+
+        logging.info(f"Resuming crawl of {seed_url}: {len(pages)} pages done, "
+                     f"{len(frontier)} queued, {len(self.seen)} URLs seen")
+        return pages, content_hashes
+
+    def save(self, frontier: Frontier, pages: List[Dict], content_hashes: Set[str],
+             in_flight: Iterable[Tuple[str, int]] = ()):
+        with self.conn:
+            self.conn.execute("DELETE FROM frontier")
+            self.conn.executemany(
+                "INSERT INTO frontier (url, depth, score, in_flight) VALUES (?, ?, ?, 0)",
+                frontier.entries()
+            )
+            self.conn.executemany(
+                "INSERT INTO frontier (url, depth, score, in_flight) VALUES (?, ?, ?, 1)",
+                [(url, depth, score_url(url)) for url, depth in in_flight]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pages (seq, page) VALUES (?, ?)",
+                [(seq, json.dumps(page, ensure_ascii=False))
+                 for seq, page in enumerate(pages[self.pages_saved:], start=self.pages_saved)]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('content_hashes', ?)",
+                (json.dumps(sorted(content_hashes)),)
+            )
+        self.pages_saved = len(pages)
+
+    def close(self, completed: bool):
+        self.conn.commit()
+        self.conn.close()
+        if completed or self.temporary:
+            for suffix in ("", "-journal", "-wal"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
@@ -0,0 +1,182 @@
+import os
+import io
+import time
+import random
+import pstats
+import cProfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value not in (float("inf"), float("-inf")) else ("+Inf" if value > 0 else "-Inf")
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple, List] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self.series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(key, ('le', format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+# Gauges are read from a callback at scrape time, so nothing has to push updates.
+class Gauge:
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Dict[Tuple, float]]) -> Gauge:
+        with self.lock:
+            self.metrics[name] = Gauge(name, help, collect)
+            return self.metrics[name]
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+SEARCH_STAGE = REGISTRY.histogram("koala_search_stage_seconds", "Time spent in each stage of the search path")
+SEARCH_REQUEST = REGISTRY.histogram("koala_search_request_seconds", "End-to-end /search handler time")
+CRAWL_STAGE = REGISTRY.histogram("koala_crawl_stage_seconds", "Time spent in each stage of crawling and ingestion")
+BATCH_SIZE = REGISTRY.histogram("koala_search_batch_size", "Queries per encoder/index batch",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+# Samples a fraction of calls under cProfile and keeps the profiles of the slow ones, so the
+# hot functions behind a latency spike can be inspected without profiling every request.
+class SlowProfiler:
+    def __init__(self, sample_rate: float = 0.0, slow_seconds: float = 0.5, keep: int = 20,
+                 output_dir: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.output_dir = output_dir
+        self.profiles = deque(maxlen=keep)
+        self.lock = threading.Lock()
+        # Only one cProfile profiler can be active per process; overlapping samples are skipped.
+        self.active = threading.Lock()
+
+    def call(self, label: str, fn: Callable, *args, **kwargs):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self.active.acquire(blocking=False):
+            return fn(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            self.active.release()
+            if seconds >= self.slow_seconds:
+                self._record(label, seconds, profiler)
+
+    def _record(self, label: str, seconds: float, profiler: cProfile.Profile):
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(25)
+        entry = {"label": label, "seconds": round(seconds, 4), "at": time.time(), "profile": stream.getvalue()}
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"{label}-{int(entry['at'] * 1000)}.prof")
+            profiler.dump_stats(path)
+            entry["path"] = path
+        with self.lock:
+            self.profiles.append(entry)
+
+    def recent(self) -> List[Dict]:
+        with self.lock:
+            return list(self.profiles)
+
+PROFILER = SlowProfiler()
@@ -0,0 +1,179 @@
+import re
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Optional, Iterable, Tuple
+
+FINGERPRINT_BITS = 64
+
+def shingles(text: str, size: int = 3) -> List[str]:
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+def hash_feature(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    features = shingles(text, shingle_size)
+    if not features:
+        return 0
+    hashes = np.array([hash_feature(feature) for feature in features], dtype='>u8')
+    bits = np.unpackbits(hashes.view('uint8')).reshape(-1, FINGERPRINT_BITS)
+    # Each bit of the fingerprint is a majority vote over the shingle hashes.
+    votes = 2 * bits.sum(axis=0, dtype='int64') - len(features)
+    return int(''.join('1' if vote > 0 else '0' for vote in votes), 2)
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+# SimHash fingerprints with LSH banding, persisted in SQLite and shared by all crawl jobs.
+# With max_distance + 1 bands, any two fingerprints within max_distance bits agree exactly
+# on at least one band, so candidates come from indexed band lookups instead of a full scan.
+class NearDuplicateIndex:
+    def __init__(self, path: str = 'near_duplicates.db', max_distance: int = 3):
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        width = FINGERPRINT_BITS // num_bands
+        self.bands = [(i * width, FINGERPRINT_BITS if i == num_bands - 1 else (i + 1) * width)
+                      for i in range(num_bands)]
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                url TEXT PRIMARY KEY,
+                fingerprint INTEGER,
+                canonical TEXT
+            );
+            CREATE TABLE IF NOT EXISTS bands (band INTEGER, key INTEGER, url TEXT);
+            CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key);
+            CREATE INDEX IF NOT EXISTS bands_url ON bands (url);
+            CREATE INDEX IF NOT EXISTS fingerprints_canonical ON fingerprints (canonical);
+        """)
+        # Counts behind stats(), loaded once and kept current by check_many and remove.
+        self.pages = self.conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        self.cluster_sizes = Counter(dict(self.conn.execute(
+            "SELECT canonical, COUNT(*) FROM fingerprints WHERE canonical IS NOT NULL GROUP BY canonical"
+        )))
+        self.duplicates = sum(self.cluster_sizes.values())
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        keys = []
+        for band, (start, end) in enumerate(self.bands):
+            shift = FINGERPRINT_BITS - end
+            keys.append((band, (fingerprint >> shift) & ((1 << (end - start)) - 1)))
+        return keys
+
+    def _find_canonical(self, url: str, fingerprint: int) -> Optional[str]:
+        best, best_distance = None, self.max_distance + 1
+        seen = set()
+        for band, key in self._band_keys(fingerprint):
+            for candidate, candidate_fp in self.conn.execute(
+                "SELECT b.url, f.fingerprint FROM bands b JOIN fingerprints f ON b.url = f.url "
+                "WHERE b.band = ? AND b.key = ?", (band, key)
+            ):
+                if candidate == url or candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = hamming_distance(fingerprint, to_unsigned(candidate_fp))
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def _drop_bands(self, urls: List[str]):
+        self.conn.executemany("DELETE FROM bands WHERE url = ?", [(url,) for url in urls])
+
+    def _count_copies(self, canonical: Optional[str], delta: int):
+        if canonical is None:
+            return
+        self.cluster_sizes[canonical] += delta
+        self.duplicates += delta
+        if self.cluster_sizes[canonical] <= 0:
+            del self.cluster_sizes[canonical]
+
+    def check_many(self, pages: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+        duplicates = {}
+        with self.lock, self.conn:
+            for url, text in pages:
+                fingerprint = simhash(text)
+                canonical = self._find_canonical(url, fingerprint)
+                previous = self.conn.execute("SELECT canonical FROM fingerprints WHERE url = ?", (url,)).fetchone()
+                if previous is None:
+                    self.pages += 1
+                else:
+                    self._count_copies(previous[0], -1)
+                self._count_copies(canonical, 1)
+                self._drop_bands([url])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO fingerprints (url, fingerprint, canonical) VALUES (?, ?, ?)",
+                    (url, to_signed(fingerprint), canonical)
+                )
+                if canonical is None:
+                    self.conn.executemany(
+                        "INSERT INTO bands (band, key, url) VALUES (?, ?, ?)",
+                        [(band, key, url) for band, key in self._band_keys(fingerprint)]
+                    )
+                else:
+                    # A former original that is now a copy hands its cluster over, so chains stay one level deep.
+                    self.conn.execute("UPDATE fingerprints SET canonical = ? WHERE canonical = ?", (canonical, url))
+                    moved = self.cluster_sizes.pop(url, 0)
+                    self.cluster_sizes[canonical] += moved
+                    duplicates[url] = canonical
+        return duplicates
+
+    def remove(self, urls: Iterable[str]):
+        urls = list(urls)
+        with self.lock, self.conn:
+            self._drop_bands(urls)
+            for url in urls:
+                row = self.conn.execute("SELECT canonical FROM fingerprints WHERE url = ?", (url,)).fetchone()
+                if row is not None:
+                    self.conn.execute("DELETE FROM fingerprints WHERE url = ?", (url,))
+                    self.pages -= 1
+                    self._count_copies(row[0], -1)
+                # Copies of a removed page are forgotten and get re-checked the next time they are crawled.
+                copies = self.conn.execute("DELETE FROM fingerprints WHERE canonical = ?", (url,)).rowcount
+                self.pages -= copies
+                self._count_copies(url, -copies)
+
+    def clusters(self, canonicals: Optional[Iterable[str]] = None, limit: int = 50) -> List[Dict]:
+        with self.lock:
+            if canonicals is None:
+                rows = self.conn.execute(
+                    "SELECT canonical, url FROM fingerprints WHERE canonical IN ("
+                    "SELECT canonical FROM fingerprints WHERE canonical IS NOT NULL "
+                    "GROUP BY canonical ORDER BY COUNT(*) DESC LIMIT ?)", (limit,)
+                ).fetchall()
+            else:
+                canonicals = list(dict.fromkeys(canonicals))[:limit]
+                rows = []
+                for canonical in canonicals:
+                    rows.extend(self.conn.execute(
+                        "SELECT canonical, url FROM fingerprints WHERE canonical = ?", (canonical,)
+                    ).fetchall())
+
+        grouped: Dict[str, List[str]] = {}
+        for canonical, url in rows:
+            grouped.setdefault(canonical, []).append(url)
+        clusters = [{"canonical": canonical, "size": len(urls) + 1, "duplicates": sorted(urls)}
+                    for canonical, urls in grouped.items()]
+        clusters.sort(key=lambda cluster: cluster["size"], reverse=True)
+        return clusters
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"pages": self.pages, "duplicates": self.duplicates, "clusters": len(self.cluster_sizes)}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,133 @@
+import re
+import hashlib
+import logging
+import importlib.util
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlparse
+from typing import List, Dict, Optional, Tuple
+
+PARSERS = ("html.parser", "lxml")
+
+SKIP_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.css', '.js', '.xml', '.zip'}
+SKIP_PATTERNS = ['#', 'javascript:', 'mailto:', 'tel:']
+
+CONTENT_SELECTORS = [
+    'main', 'article', '.content', '#content', '.post', '.entry',
+    '.article-body', '.post-content', '.entry-content'
+]
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+SYMBOL_PATTERN = re.compile(r'[^\w\s\.\,\!\?\;\:\-\(\)]')
+
+def resolve_parser(parser: str) -> str:
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown HTML parser '{parser}', expected one of {PARSERS}")
+    if parser == "lxml" and importlib.util.find_spec("lxml") is None:
+        logging.warning("lxml is not installed, falling back to html.parser")
+        return "html.parser"
+    return parser
+
+def clean_text(text: str) -> str:
+    text = WHITESPACE_PATTERN.sub(' ', text)
+    text = SYMBOL_PATTERN.sub(' ', text)
+    text = text.strip()
+    return text
+
+def valid_url(url: str, domain: str) -> bool:
+    parsed = urlparse(url)
+
+    if not (parsed.scheme in {'http', 'https'} and parsed.netloc):
+        return False
+
+    if domain and domain not in parsed.netloc:
+        return False
+
+    if any(parsed.path.lower().endswith(ext) for ext in SKIP_EXTENSIONS):
+        return False
+
+    if any(pattern in url.lower() for pattern in SKIP_PATTERNS):
+        return False
+
+    return True
+
+def extract_main_content(soup: BeautifulSoup) -> str:
+    for script in soup(["script", "style", "nav", "header", "footer", "aside"]):
+        script.decompose()
+
+    main_content = ""
+
+    for selector in CONTENT_SELECTORS:
+        content_elem = soup.select_one(selector)
+        if content_elem:
+            main_content = content_elem.get_text(separator='\n', strip=True)
+            break
+
+    if not main_content:
+        for elem in soup.find_all(['nav', 'sidebar', 'menu', 'footer', 'header']):
+            elem.decompose()
+        main_content = soup.get_text(separator='\n', strip=True)
+
+    return clean_text(main_content)
+
+def extract_metadata(soup: BeautifulSoup, url: str) -> Dict:
+    metadata = {
+        "url": url,
+        "title": "",
+        "description": "",
+        "keywords": [],
+        "last_modified": None
+    }
+
+    title_tag = soup.find('title')
+    if title_tag:
+        metadata["title"] = clean_text(title_tag.get_text())
+
+    meta_desc = soup.find('meta', attrs={"name": "description"}) or \
+               soup.find('meta', attrs={"property": "og:description"})
+    if meta_desc and meta_desc.get('content'):
+        metadata["description"] = clean_text(meta_desc['content'])
+
+    meta_keywords = soup.find('meta', attrs={"name": "keywords"})
+    if meta_keywords and meta_keywords.get('content'):
+        metadata["keywords"] = [k.strip() for k in meta_keywords['content'].split(',')]
+
+    return metadata
+
+def extract_links(soup: BeautifulSoup, url: str) -> List[str]:
+    links = []
+    domain = urlparse(url).netloc
+    for link_tag in soup.find_all('a', href=True):
+        href = link_tag.get('href', '').strip()
+        if not href:
+            continue
+
+        full_url = urljoin(url, href)
+
+        parsed = urlparse(full_url)
+        clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        if parsed.query:
+            clean_url += f"?{parsed.query}"
+
+        if valid_url(clean_url, domain) and clean_url != url:
+            links.append(clean_url)
+    return links
+
+# Pure function of the raw HTML so it can run in a worker process: everything that depends on
+# crawl state (seen content hashes, visited URLs) is applied by the crawler on the result.
+def parse_page(url: str, html: str, parser: str = "html.parser") -> Tuple[Optional[Dict], int, str, List[str]]:
+    soup = BeautifulSoup(html, parser)
+
+    content = extract_main_content(soup)
+
+    word_count = len(content.split())
+    if not content or word_count < 10:
+        return None, word_count, "", []
+
+    content_sample = content[:500] if len(content) > 500 else content
+    content_hash = hashlib.md5(content_sample.encode()).hexdigest()
+
+    metadata = extract_metadata(soup, url)
+    metadata["content"] = content
+    metadata["word_count"] = word_count
+
+    return metadata, word_count, content_hash, extract_links(soup, url)
@@ -0,0 +1,235 @@
+import os
+import json
+import math
+import time
+import heapq
+import base64
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# Space-Saving heavy hitters: at most `capacity` counters. A new key evicts the smallest
+# counter and inherits its count, so every true top-k query with frequency above N/capacity
+# is kept and its count is overestimated by at most the recorded error.
+class SpaceSaving:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.heap: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def _pop_min(self) -> Tuple[str, int]:
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def add(self, key: str, count: int = 1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            min_key, min_count = self._pop_min()
+            del self.counts[min_key]
+            del self.errors[min_key]
+            self.counts[key] = min_count + count
+            self.errors[key] = min_count
+        heapq.heappush(self.heap, (self.counts[key], key))
+        # Stale heap entries are dropped lazily; rebuild before they outgrow the counters.
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        return heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+
+    @classmethod
+    def merge(cls, summaries: Iterable['SpaceSaving'], capacity: int) -> 'SpaceSaving':
+        counts: Dict[str, int] = {}
+        errors: Dict[str, int] = {}
+        for summary in summaries:
+            for key, count in summary.counts.items():
+                counts[key] = counts.get(key, 0) + count
+                errors[key] = errors.get(key, 0) + summary.errors[key]
+        merged = cls(capacity)
+        for key, count in heapq.nlargest(capacity, counts.items(), key=lambda item: item[1]):
+            merged.counts[key] = count
+            merged.errors[key] = errors[key]
+        merged.heap = [(count, key) for key, count in merged.counts.items()]
+        heapq.heapify(merged.heap)
+        return merged
+
+    def to_dict(self) -> Dict:
+        return {"capacity": self.capacity, "counts": self.counts, "errors": self.errors}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SpaceSaving':
+        summary = cls(data["capacity"])
+        summary.counts = {key: int(count) for key, count in data["counts"].items()}
+        summary.errors = {key: int(data["errors"].get(key, 0)) for key in summary.counts}
+        summary.heap = [(count, key) for key, count in summary.counts.items()]
+        heapq.heapify(summary.heap)
+        return summary
+
+# Distinct-count estimate in 2^p bytes (about 1.6% standard error at p=12).
+class HyperLogLog:
+    def __init__(self, p: int = 12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, item: str):
+        h = int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & ((1 << 64) - 1)
+        rank = min(64 - rest.bit_length() + 1, 64 - self.p + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> Dict:
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'HyperLogLog':
+        sketch = cls(data["p"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+# Bucket granularity: (bucket seconds, buckets kept).
+WINDOWS = {"minute": (60, 60), "hour": (3600, 24)}
+# Queryable windows: (bucket granularity, window seconds).
+WINDOW_SPANS = {"minute": ("minute", 60), "hour": ("minute", 3600), "day": ("hour", 86400)}
+
+# Fixed-memory query analytics: an all-time heavy-hitter summary, per-minute buckets for the
+# last hour and per-hour buckets for the last day, a distinct-query estimate and the last
+# searches. Everything is snapshotted to JSON and restored on startup.
+class QueryAnalytics:
+    def __init__(self, snapshot_path: Optional[str] = "analytics.json", capacity: int = 1000,
+                 window_capacity: int = 200, recent_size: int = 100):
+        self.snapshot_path = snapshot_path
+        self.capacity = capacity
+        self.window_capacity = window_capacity
+        self.lock = threading.Lock()
+
+        self.total_searches = 0
+        self.total_time = 0.0
+        self.all_time = SpaceSaving(capacity)
+        self.unique = HyperLogLog()
+        self.recent: Deque[Dict] = deque(maxlen=recent_size)
+        self.buckets: Dict[str, Deque[Tuple[int, SpaceSaving]]] = {name: deque() for name in WINDOWS}
+        self.dirty = False
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load()
+
+    def _bucket(self, window: str, now: float) -> SpaceSaving:
+        span, keep = WINDOWS[window]
+        start = int(now // span) * span
+        buckets = self.buckets[window]
+        if not buckets or buckets[-1][0] != start:
+            buckets.append((start, SpaceSaving(self.window_capacity)))
+        while buckets and buckets[0][0] <= start - span * keep:
+            buckets.popleft()
+        return buckets[-1][1]
+
+    def record(self, query: str, results_count: int, time_taken: float, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        query_lower = query.lower()
+        with self.lock:
+            self.total_searches += 1
+            self.total_time += time_taken
+            self.all_time.add(query_lower)
+            self.unique.add(query_lower)
+            for window in WINDOWS:
+                self._bucket(window, now).add(query_lower)
+            self.recent.append({
+                "query": query,
+                "results": results_count,
+                "time": time_taken,
+                "timestamp": datetime.fromtimestamp(now).isoformat()
+            })
+            self.dirty = True
+
+    def top(self, k: int = 10, window: str = "all", now: Optional[float] = None) -> List[Tuple[str, int]]:
+        now = time.time() if now is None else now
+        with self.lock:
+            if window == "all":
+                return self.all_time.top(k)
+            if window not in WINDOW_SPANS:
+                raise ValueError(f"Unknown window '{window}', expected all, {', '.join(WINDOW_SPANS)}")
+            # A window covers the buckets overlapping it, so "minute" still answers right
+            # after a minute boundary instead of dropping to an empty bucket.
+            source, seconds = WINDOW_SPANS[window]
+            bucket_span = WINDOWS[source][0]
+            summaries = [summary for start, summary in self.buckets[source] if start > now - seconds - bucket_span]
+            return SpaceSaving.merge(summaries, self.window_capacity).top(k)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "total_searches": self.total_searches,
+                "recent_searches_count": len(self.recent),
+                "unique_queries": self.unique.count(),
+                "avg_time": round(self.total_time / self.total_searches, 4) if self.total_searches else 0.0,
+                "tracked_queries": len(self.all_time)
+            }
+
+    def recent_searches(self) -> List[Dict]:
+        with self.lock:
+            return list(self.recent)
+
+    def to_dict(self) -> Dict:
+        return {
+            "total_searches": self.total_searches,
+            "total_time": self.total_time,
+            "all_time": self.all_time.to_dict(),
+            "unique": self.unique.to_dict(),
+            "recent": list(self.recent),
+            "buckets": {window: [(start, summary.to_dict()) for start, summary in buckets]
+                        for window, buckets in self.buckets.items()}
+        }
+
+    def save(self):
+        if not self.snapshot_path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            snapshot = json.dumps(self.to_dict())
+            self.dirty = False
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(snapshot)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load(self):
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Could not load analytics snapshot {self.snapshot_path}: {e}")
+            return
+        with self.lock:
+            self.total_searches = data["total_searches"]
+            self.total_time = data["total_time"]
+            self.all_time = SpaceSaving.from_dict(data["all_time"])
+            self.unique = HyperLogLog.from_dict(data["unique"])
+            self.recent.extend(data["recent"])
+            for window, buckets in data["buckets"].items():
+                if window in self.buckets:
+                    self.buckets[window] = deque((start, SpaceSaving.from_dict(summary)) for start, summary in buckets)
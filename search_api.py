@@ -1,16 +1,46 @@
-from fastapi import FastAPI, Query, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl
-from typing import List, Dict, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, HttpUrl
+from typing import List, Dict, Optional, Set, Tuple
+from contextlib import asynccontextmanager
 import time
-from search_engine import SearchEngine
-from crawler import Crawler
 import json
+import asyncio
+import threading
+from document_store import DocumentStore, url_to_id
+from crawl_pool import CrawlPool
+from site_registry import SiteRegistry
+from metrics import REGISTRY, SEARCH_STAGE, SEARCH_REQUEST, CRAWL_STAGE, PROFILER
+from query_analytics import QueryAnalytics, WINDOW_SPANS
 from datetime import datetime
 import os
 import uuid
 
-app = FastAPI(title="Koala Search API", version="1.0.0")
+# The engine, lexical index, near-duplicate index and crawler are imported inside their
+# get_* factories, so importing this module does not load faiss, torch or bs4.
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    preload = None
+    if os.getenv("KOALA_PRELOAD", "1") == "1" and claim_engine_build():
+        preload = asyncio.create_task(asyncio.to_thread(preload_search_engine))
+    snapshots = asyncio.create_task(snapshot_analytics())
+    yield
+    snapshots.cancel()
+    await asyncio.gather(snapshots, return_exceptions=True)
+    await asyncio.to_thread(analytics.save)
+    if preload is not None and not preload.done():
+        await asyncio.gather(preload, return_exceptions=True)
+    if search_batcher is not None:
+        await search_batcher.close()
+    if crawl_pool is not None:
+        crawl_pool.close()
+    if num_shards and search_engine is not None:
+        await asyncio.to_thread(search_engine.close)
+    registry.close()
+
+app = FastAPI(title="Koala Search API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,29 +51,176 @@ app.add_middleware(
 )
 
 search_engine = None
-crawl_jobs = {}
-websites_db = "websites.json"
+search_batcher = None
+document_store = None
+lexical_index = None
+near_duplicates = None
+crawl_pool = None
+registry = SiteRegistry(
+    websites_path="websites.json",
+    jobs_path="crawl_jobs.json",
+    flush_interval=float(os.getenv("KOALA_REGISTRY_FLUSH_SECONDS", "1.0")),
+    max_finished_jobs=int(os.getenv("KOALA_MAX_JOB_HISTORY", "1000"))
+)
+checkpoints_dir = "crawl_checkpoints"
+num_shards = int(os.getenv("KOALA_SHARDS", "0"))
+engine_lock = threading.Lock()
+build_lock = threading.Lock()
+# Held by each crawl job from its store write through compaction and the lexical sync to the
+# vector index update, so concurrent jobs never interleave those steps.
+ingest_lock = threading.Lock()
+startup_state = {
+    "status": "idle",
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "ready_at": None,
+    "error": None
+}
+
+def get_document_store():
+    global document_store
+    if document_store is None:
+        document_store = DocumentStore("documents")
+        if not len(document_store) and os.path.exists("prepared_data.json"):
+            print("[INFO] Importing prepared_data.json into the document store...")
+            document_store.import_json("prepared_data.json")
+    return document_store
+
+def get_lexical_index():
+    global lexical_index
+    if lexical_index is None:
+        from bm25_index import BM25Index
+        lexical_index = BM25Index("lexical_index.db")
+        stats = lexical_index.sync(get_document_store())
+        print(f"[INFO] Lexical index sync: {stats['indexed']} documents indexed, {stats['removed']} removed")
+    return lexical_index
+
+def get_near_duplicates():
+    global near_duplicates
+    if near_duplicates is None:
+        from near_duplicates import NearDuplicateIndex
+        near_duplicates = NearDuplicateIndex(
+            "near_duplicates.db",
+            max_distance=int(os.getenv("KOALA_NEAR_DUPLICATE_DISTANCE", "3"))
+        )
+    return near_duplicates
+
+def engine_options() -> Dict:
+    return {
+        "index_type": os.getenv("KOALA_INDEX_TYPE", "flat"),
+        "cache_size": int(os.getenv("KOALA_CACHE_SIZE", "1024")),
+        "cache_ttl": float(os.getenv("KOALA_CACHE_TTL", "300")),
+        "mmap_index": os.getenv("KOALA_INDEX_MMAP", "0") == "1",
+        "rerank_factor": int(os.getenv("KOALA_RERANK_FACTOR", "4")),
+        "max_results": int(os.getenv("KOALA_MAX_RESULTS", "500"))
+    }
+
+# With KOALA_SHARDS set, documents live in per-shard worker processes and the API talks to
+# a coordinator with the same search interface as SearchEngine.
+def get_sharded_engine():
+    global search_engine
+    with engine_lock:
+        if search_engine is None:
+            from sharding import ShardedSearchEngine
+            options = engine_options()
+            search_engine = ShardedSearchEngine(
+                path=os.getenv("KOALA_SHARD_DIR", "shards"),
+                num_shards=num_shards,
+                strategy=os.getenv("KOALA_SHARD_STRATEGY", "hash"),
+                engine_options=options,
+                max_results=options.pop("max_results"),
+                cache_size=options["cache_size"],
+                cache_ttl=options["cache_ttl"]
+            )
+    return search_engine
 
 def get_search_engine():
     global search_engine
-    if search_engine is None and os.path.exists("prepared_data.json"):
-        search_engine = SearchEngine("prepared_data.json")
+    if num_shards:
+        return get_sharded_engine()
+    with engine_lock:
+        store = get_document_store()
+        if search_engine is None and len(store):
+            from search_engine import SearchEngine
+            search_engine = SearchEngine(store, lexical=get_lexical_index(), **engine_options())
     return search_engine
 
-def load_websites():
-    if os.path.exists(websites_db):
-        with open(websites_db, 'r') as f:
-            return json.load(f)
-    return []
+# The engine is only built by preload_search_engine on a background thread. Request handlers
+# and crawl jobs never wait on engine_lock: they read the search_engine global and, while it is
+# still None or warming up, answer 503 or leave the new pages to the build.
+def claim_engine_build() -> bool:
+    with build_lock:
+        if search_engine is not None or startup_state["status"] == "loading":
+            return False
+        startup_state["status"] = "loading"
+        return True
+
+def start_engine_build():
+    if claim_engine_build():
+        threading.Thread(target=preload_search_engine, daemon=True).start()
+
+def engine_unavailable() -> HTTPException:
+    # With KOALA_PRELOAD=0 the first request starts the build.
+    if startup_state["status"] == "idle":
+        start_engine_build()
+    if startup_state["status"] == "loading":
+        return HTTPException(status_code=503, detail="Search index is building, try again shortly.")
+    if startup_state["status"] == "failed":
+        return HTTPException(status_code=503, detail=f"Search engine failed to load: {startup_state['error']}")
+    return HTTPException(status_code=503, detail="Search engine not ready. Please add and crawl some websites first.")
+
+def preload_search_engine():
+    startup_state["status"] = "loading"
+    try:
+        start = time.perf_counter()
+        engine = get_search_engine()
+        startup_state["load_seconds"] = round(time.perf_counter() - start, 3)
+        if engine is None:
+            startup_state["status"] = "empty"
+            return
+        # Pages a crawl stored while the engine was being built are indexed before it goes live.
+        with ingest_lock:
+            engine.sync_index()
+        start = time.perf_counter()
+        engine.warm_up()
+        startup_state["warmup_seconds"] = round(time.perf_counter() - start, 3)
+        startup_state["status"] = "ready"
+        startup_state["ready_at"] = datetime.now().isoformat()
+        print(f"[INFO] Search engine ready: loaded in {startup_state['load_seconds']}s, "
+              f"warmed up in {startup_state['warmup_seconds']}s")
+    except Exception as e:
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+        print(f"[ERROR] Search engine preload failed: {e}")
+
+def get_search_batcher():
+    global search_batcher
+    if startup_state["status"] == "loading":
+        return None
+    if search_batcher is None and search_engine is not None:
+        from search_batcher import SearchBatcher
+        search_batcher = SearchBatcher(
+            search_engine,
+            max_batch_size=int(os.getenv("KOALA_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("KOALA_BATCH_WAIT_MS", "5")),
+            workers=int(os.getenv("KOALA_SEARCH_WORKERS", "2"))
+        )
+    return search_batcher
 
-def save_websites(websites):
-    with open(websites_db, 'w') as f:
-        json.dump(websites, f, indent=2)
+def get_crawl_pool():
+    global crawl_pool
+    if crawl_pool is None:
+        crawl_pool = CrawlPool(max_concurrent=int(os.getenv("KOALA_MAX_CONCURRENT_CRAWLS", "2")))
+    return crawl_pool
+
+def checkpoint_path(website_id: str) -> str:
+    return os.path.join(checkpoints_dir, f"{website_id}.db")
 
 class SearchResult(BaseModel):
     url: str
     score: float
     snippet: str
+    highlights: List[Tuple[int, int]] = []
     title: Optional[str] = None
     
 class SearchResponse(BaseModel):
@@ -53,6 +230,22 @@ class SearchResponse(BaseModel):
     page: int
     per_page: int
     query: str
+    next_cursor: Optional[str] = None
+
+class BatchQuery(BaseModel):
+    q: str = Field(..., min_length=1)
+    id: Optional[str] = None
+    page: int = Field(1, ge=1)
+    per_page: int = Field(10, ge=1, le=50)
+    sort_by: str = "score"
+    domain: Optional[str] = None
+    expand: bool = True
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+    mode: str = "vector"
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery] = Field(..., min_length=1)
 
 class Website(BaseModel):
     url: HttpUrl
@@ -78,16 +271,37 @@ class CrawlJob(BaseModel):
     website_id: str
     status: str
     pages_crawled: int
+    pages_queued: int = 0
     total_pages: int
-    started_at: str
+    queued_at: Optional[str] = None
+    started_at: Optional[str] = None
     completed_at: Optional[str] = None
     error_message: Optional[str] = None
+    pages_indexed: int = 0
+    near_duplicates: Optional[Dict] = None
+    recrawl: Optional[Dict[str, int]] = None
+    index_update: Optional[Dict[str, int]] = None
 
-search_stats = {
-    "total_searches": 0,
-    "recent_searches": [],
-    "popular_queries": {}
-}
+analytics = QueryAnalytics(
+    snapshot_path=os.getenv("KOALA_ANALYTICS_SNAPSHOT", "analytics.json") or None,
+    capacity=int(os.getenv("KOALA_ANALYTICS_TOP_K", "1000")),
+    window_capacity=int(os.getenv("KOALA_ANALYTICS_WINDOW_TOP_K", "200"))
+)
+analytics_snapshot_interval = float(os.getenv("KOALA_ANALYTICS_SNAPSHOT_INTERVAL", "60"))
+crawl_requests_per_second = float(os.getenv("KOALA_CRAWL_RPS", "2"))
+ingest_queue_size = int(os.getenv("KOALA_INGEST_QUEUE_SIZE", "64"))
+ingest_batch_size = int(os.getenv("KOALA_INGEST_BATCH_SIZE", "32"))
+ingest_flush_seconds = float(os.getenv("KOALA_INGEST_FLUSH_SECONDS", "5"))
+bulk_max_queries = int(os.getenv("KOALA_BULK_MAX_QUERIES", "10000"))
+bulk_chunk_size = int(os.getenv("KOALA_BULK_CHUNK_SIZE", "256"))
+
+async def snapshot_analytics():
+    while True:
+        await asyncio.sleep(analytics_snapshot_interval)
+        try:
+            await asyncio.to_thread(analytics.save)
+        except OSError as e:
+            print(f"[WARNING] Could not write analytics snapshot: {e}")
 
 SYNONYMS = {
     "python": ["python", "py", "python3"],
@@ -110,90 +324,200 @@ def expand_query(query: str) -> str:
     return " ".join(expanded)
 
 def log_search(query: str, results_count: int, time_taken: float):
-    global search_stats
-    
-    search_stats["total_searches"] += 1
-    search_log = {
-        "query": query,
-        "results": results_count,
-        "time": time_taken,
-        "timestamp": datetime.now().isoformat()
-    }
-    search_stats["recent_searches"].append(search_log)
+    analytics.record(query, results_count, time_taken)
+
+def site_validators(site_url: str) -> Dict[str, Dict]:
+    if num_shards:
+        return get_sharded_engine().validators_with_prefix(site_url)
+    return get_document_store().validators_with_prefix(site_url)
+
+# With prune, stored pages under site_url that are not in crawled_urls (by default the pages
+# in data) are removed; streamed batches of a running crawl skip it until the crawl completes.
+# They are also ingested incrementally: no segment compaction, and the lexical index only
+# looks at the batch's documents, whose ids are returned in stats["doc_ids"] for the vector index.
+def ingest_pages(site_url: str, data: List[Dict], validators: Optional[Dict[str, Dict]] = None,
+                 prune: bool = True, crawled_urls: Optional[Set[str]] = None,
+                 incremental: bool = False) -> Dict:
+    sharded = get_sharded_engine() if num_shards else None
+    store = None if sharded else get_document_store()
+    removed_urls = []
+    if prune:
+        crawled_urls = {page["url"] for page in data} if crawled_urls is None else crawled_urls
+        site_urls = sharded.urls_with_prefix(site_url) if sharded else store.urls_with_prefix(site_url)
+        removed_urls = [url for url in site_urls if url not in crawled_urls]
+    # Pages the crawler found unchanged keep their stored document, passages and vectors.
+    changed = [page for page in data if not page.get("unchanged")]
     
-    if len(search_stats["recent_searches"]) > 100:
-        search_stats["recent_searches"] = search_stats["recent_searches"][-100:]
+    # Near-copies of pages already in the corpus (from this or any other site) never reach the embedder.
+    dedup = get_near_duplicates()
+    with CRAWL_STAGE.time(stage="near_dedup"):
+        dedup.remove(removed_urls)
+        duplicates = dedup.check_many((page["url"], page.get("content", "")) for page in changed)
+        duplicate_urls = list(duplicates) if sharded else [url for url in duplicates if url_to_id(url) in store]
     
-    query_lower = query.lower()
-    search_stats["popular_queries"][query_lower] = search_stats["popular_queries"].get(query_lower, 0) + 1
+    pages = [page for page in changed if page["url"] not in duplicates]
+    # A duplicate is not stored, so it keeps no validators; otherwise a recrawl would see it as
+    # unchanged and never re-check it once its canonical page changes.
+    if validators:
+        validators = {url: v for url, v in validators.items() if url not in duplicates}
+    delete_urls = removed_urls + duplicate_urls
+    with CRAWL_STAGE.time(stage="write"):
+        if sharded:
+            stats = sharded.ingest(pages, delete_urls, validators, incremental)
+        else:
+            stats = store.put_many(pages)
+            stats["removed"] = len(store.delete(delete_urls))
+            if validators:
+                store.put_validators(validators)
+            if not incremental:
+                store.compact()
+    doc_ids = [url_to_id(page["url"]) for page in pages] + [url_to_id(url) for url in delete_urls]
+    stats["doc_ids"] = doc_ids if incremental else None
+    stats["skipped_unchanged"] = len(data) - len(changed)
+    stats["near_duplicates"] = len(duplicates)
+    stats["duplicate_clusters"] = dedup.clusters(duplicates.values())
+    # Shards sync their own lexical index as part of the write.
+    if not sharded:
+        with CRAWL_STAGE.time(stage="lexical_index"):
+            get_lexical_index().sync(store, doc_ids=stats["doc_ids"])
+    return stats
 
-async def crawl_website_background(website_id: str, website_data: dict):
+# With fresh, an earlier crawl's checkpoint is discarded, but only once this job has been
+# registered, so a queued or running crawl keeps its own.
+def start_crawl_job(website_id: str, website_data: dict, fresh: bool = False) -> Optional[str]:
     job_id = str(uuid.uuid4())
     
-    crawl_jobs[job_id] = {
+    added = registry.add_job({
         "id": job_id,
         "website_id": website_id,
-        "status": "running",
+        "status": "queued",
         "pages_crawled": 0,
+        "pages_queued": 0,
         "total_pages": website_data["max_pages"],
-        "started_at": datetime.now().isoformat(),
+        "queued_at": datetime.now().isoformat(),
+        "started_at": None,
         "completed_at": None,
         "error_message": None
-    }
+    })
+    if not added:
+        return None
+    if fresh and os.path.exists(checkpoint_path(website_id)):
+        os.remove(checkpoint_path(website_id))
+    registry.update_website(website_id, status="pending")
+    get_crawl_pool().submit(job_id, run_crawl_job, job_id, website_id, website_data)
+    return job_id
+
+def update_search_index(persist: bool = True, doc_ids: Optional[List[int]] = None) -> Dict[str, int]:
+    if search_engine is None:
+        # Building the engine indexes everything stored so far, so a first crawl into an empty
+        # corpus becomes searchable while it runs. The build runs on its own thread.
+        start_engine_build()
+        return {}
+    return search_engine.sync_index(persist, doc_ids)
+
+# Pages flow from the crawler through a bounded queue and are written, deduplicated and added
+# to the live index in batches; while a batch is being indexed the queue fills up and the
+# crawl workers wait.
+async def crawl_and_ingest(job_id: str, website_id: str, crawler, website_data: dict, on_progress) -> Dict:
+    site_url = website_data["url"]
+    totals = {"pages": 0, "written": 0, "unchanged": 0, "removed": 0, "skipped_unchanged": 0, "near_duplicates": 0}
+    index_update = {"embedded": 0, "passages": 0, "removed": 0}
+    canonicals: List[str] = []
+    
+    def ingest(pages: List[Dict], final: bool):
+        with ingest_lock:
+            # Pages that disappeared from the site are only pruned once the crawl has seen all of it.
+            if final and not crawler.cancelled:
+                stats = ingest_pages(site_url, pages, crawler.new_validators,
+                                     crawled_urls={page["url"] for page in crawler.data})
+            else:
+                validators = {page["url"]: crawler.new_validators[page["url"]]
+                              for page in pages if page["url"] in crawler.new_validators}
+                stats = ingest_pages(site_url, pages, validators, prune=False, incremental=not final)
+            # The index file is written once, with the final batch.
+            update = update_search_index(persist=final, doc_ids=stats["doc_ids"])
+        totals["pages"] += len(pages)
+        for key in ("written", "unchanged", "removed", "skipped_unchanged", "near_duplicates"):
+            totals[key] += stats[key]
+        canonicals.extend(cluster["canonical"] for cluster in stats["duplicate_clusters"])
+        for key, value in update.items():
+            index_update[key] += value
+        registry.update_job(job_id, pages_indexed=totals["pages"], index_update=dict(index_update))
+    
+    async for batch in crawler.crawl_stream(
+        site_url,
+        queue_size=ingest_queue_size,
+        batch_size=ingest_batch_size,
+        flush_seconds=ingest_flush_seconds,
+        max_pages=website_data["max_pages"],
+        max_depth=website_data["max_depth"],
+        requests_per_second=crawl_requests_per_second,
+        checkpoint_path=checkpoint_path(website_id),
+        on_progress=on_progress
+    ):
+        await asyncio.to_thread(ingest, batch, False)
+    
+    # The closing ingest carries no new pages; it prunes, compacts and fully syncs the indexes.
+    await asyncio.to_thread(ingest, [], True)
+    totals["duplicate_clusters"] = get_near_duplicates().clusters(canonicals)
+    return totals
+
+def run_crawl_job(job_id: str, website_id: str, website_data: dict, cancel_event: threading.Event):
+    registry.update_job(job_id, status="running", started_at=datetime.now().isoformat())
+    registry.update_website(website_id, status="crawling")
+    
+    def on_progress(pages_crawled: int, pages_queued: int):
+        registry.update_job(job_id, pages_crawled=pages_crawled, pages_queued=pages_queued)
     
     try:
-        crawler = Crawler()
-        data = crawler.crawl(
-            website_data["url"], 
-            max_pages=website_data["max_pages"],
-            max_depth=website_data["max_depth"]
+        from crawler import Crawler
+        crawler = Crawler(
+            parser=os.getenv("KOALA_HTML_PARSER", "html.parser"),
+            parse_workers=int(os.environ["KOALA_PARSE_WORKERS"]) if "KOALA_PARSE_WORKERS" in os.environ else None,
+            cancel_event=cancel_event,
+            validators=site_validators(website_data["url"])
+        )
+        ingest_stats = asyncio.run(crawl_and_ingest(job_id, website_id, crawler, website_data, on_progress))
+        registry.update_job(job_id, pages_crawled=len(crawler.data))
+        # Pages answered with 304 or an identical body, plus re-fetched pages whose extracted
+        # text did not change, are neither re-embedded nor re-indexed.
+        registry.update_job(
+            job_id,
+            near_duplicates={
+                "skipped": ingest_stats["near_duplicates"],
+                "clusters": ingest_stats["duplicate_clusters"]
+            },
+            recrawl=dict(
+                crawler.recrawl_stats,
+                pages_changed=ingest_stats["written"],
+                encodes_skipped=ingest_stats["skipped_unchanged"] + ingest_stats["unchanged"]
+            )
         )
         
-        existing_data = []
-        if os.path.exists("prepared_data.json"):
-            with open("prepared_data.json", 'r') as f:
-                existing_data = json.load(f)
-        
-        existing_data = [item for item in existing_data 
-                        if not (isinstance(item, dict) and item.get("url", "").startswith(website_data["url"]))]
-        
-        existing_data.extend(data)
-        
-        with open("prepared_data.json", 'w') as f:
-            json.dump(existing_data, f, indent=2)
-        
-        websites = load_websites()
-        for website in websites:
-            if website["id"] == website_id:
-                website["status"] = "completed"
-                website["pages_crawled"] = len(data)
-                website["last_crawled"] = datetime.now().isoformat()
-                break
-        save_websites(websites)
-        
-        crawl_jobs[job_id]["status"] = "completed"
-        crawl_jobs[job_id]["pages_crawled"] = len(data)
-        crawl_jobs[job_id]["completed_at"] = datetime.now().isoformat()
+        if crawler.cancelled:
+            registry.update_job(job_id, status="cancelled", completed_at=datetime.now().isoformat())
+            registry.update_website(website_id, status="cancelled")
+            return
         
-        global search_engine
-        search_engine = None
+        registry.update_website(website_id, status="completed", pages_crawled=len(crawler.data),
+                                last_crawled=datetime.now().isoformat())
+        registry.update_job(job_id, status="completed", completed_at=datetime.now().isoformat())
         
     except Exception as e:
-        crawl_jobs[job_id]["status"] = "failed"
-        crawl_jobs[job_id]["error_message"] = str(e)
-        crawl_jobs[job_id]["completed_at"] = datetime.now().isoformat()
-        
-        websites = load_websites()
-        for website in websites:
-            if website["id"] == website_id:
-                website["status"] = "failed"
-                break
-        save_websites(websites)
+        registry.update_job(job_id, status="failed", error_message=str(e), completed_at=datetime.now().isoformat())
+        registry.update_website(website_id, status="failed")
 
 @app.get("/")
 async def root():
     return {"message": "Koala Search API", "version": "1.0.0"}
 
+@app.get("/ready")
+async def ready():
+    state = dict(startup_state, engine_loaded=search_engine is not None)
+    if state["status"] in ("ready", "empty") or (state["status"] == "idle" and search_engine is not None):
+        return state
+    return JSONResponse(status_code=503, content=state)
+
 @app.get("/search", response_model=SearchResponse)
 async def search(
     q: str = Query(..., min_length=1, description="Search query"),
@@ -201,57 +525,130 @@ async def search(
     per_page: int = Query(10, ge=1, le=50, description="Results per page"),
     sort_by: str = Query("score", description="Sort by score or relevance"),
     domain: Optional[str] = Query(None, description="Filter by domain"),
-    expand: bool = Query(True, description="Use query expansion")
+    expand: bool = Query(True, description="Use query expansion"),
+    nprobe: Optional[int] = Query(None, ge=1, description="IVF lists to probe (ivf/ivfpq indexes)"),
+    ef_search: Optional[int] = Query(None, ge=1, description="HNSW search depth (hnsw index)"),
+    mode: str = Query("vector", description="Retrieval mode: vector, bm25 or hybrid"),
+    cursor: Optional[str] = Query(None, description="next_cursor from a previous response")
 ):
     start_time = time.time()
+    request_start = time.perf_counter()
     
-    engine = get_search_engine()
-    if not engine:
-        raise HTTPException(status_code=503, detail="Search engine not ready. Please add and crawl some websites first.")
+    batcher = get_search_batcher()
+    if not batcher:
+        raise engine_unavailable()
+    from search_engine import SEARCH_MODES
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
     
-    query = expand_query(q) if expand else q
+    with SEARCH_STAGE.time(stage="expand_query"):
+        query = expand_query(q) if expand else q
     
-    results = engine.search(
-        query=query,
-        top_k=per_page * 2,
-        sort_by=sort_by,
-        page=page,
-        per_page=per_page,
-        domain=domain
-    )
+    if cursor:
+        try:
+            search_page = await asyncio.to_thread(search_engine.search_cursor, cursor, per_page)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        search_page = await batcher.search(
+            query=query,
+            sort_by=sort_by,
+            page=page,
+            per_page=per_page,
+            domain=domain,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            mode=mode
+        )
     
-    formatted_results = [
-        SearchResult(url=url, score=score, snippet=snippet) 
-        for url, score, snippet in results
-    ]
+    with SEARCH_STAGE.time(stage="serialize"):
+        formatted_results = [
+            SearchResult(url=url, score=score, snippet=snippet, highlights=highlights)
+            for url, score, snippet, highlights in search_page["results"]
+        ]
+        
+        time_taken = time.time() - start_time
+        
+        response = SearchResponse(
+            results=formatted_results,
+            total=search_page["total"],
+            time_taken=time_taken,
+            page=search_page["page"],
+            per_page=per_page,
+            query=q,
+            next_cursor=search_page["next_cursor"]
+        )
+        # Serialized here rather than by FastAPI so the cost shows up in the serialize stage.
+        body = JSONResponse(content=response.model_dump(mode="json"))
     
-    time_taken = time.time() - start_time
+    # Following a cursor pages through an earlier search rather than running a new one.
+    if not cursor:
+        log_search(q, len(formatted_results), time_taken)
+    SEARCH_REQUEST.observe(time.perf_counter() - request_start, mode=mode)
+    return body
+
+# Bulk and evaluation traffic: queries skip the latency batcher and go to the engine in chunks
+# of KOALA_BULK_CHUNK_SIZE, each encoded in one model call and searched in one index call per
+# parameter group. One NDJSON line per query is streamed as soon as its chunk finishes.
+@app.post("/search/batch")
+async def search_batch(batch: BatchSearchRequest):
+    if len(batch.queries) > bulk_max_queries:
+        raise HTTPException(status_code=413, detail=f"At most {bulk_max_queries} queries per batch")
+    engine = search_engine
+    if engine is None or startup_state["status"] == "loading":
+        raise engine_unavailable()
+    from search_engine import SEARCH_MODES
     
-    response = SearchResponse(
-        results=formatted_results,
-        total=len(formatted_results),
-        time_taken=time_taken,
-        page=page,
-        per_page=per_page,
-        query=q
-    )
+    async def lines():
+        for start in range(0, len(batch.queries), bulk_chunk_size):
+            chunk = list(enumerate(batch.queries[start:start + bulk_chunk_size], start))
+            invalid = {index for index, item in chunk if item.mode not in SEARCH_MODES}
+            requests = [{
+                "query": expand_query(item.q) if item.expand else item.q,
+                "sort_by": item.sort_by,
+                "page": item.page,
+                "per_page": item.per_page,
+                "domain": item.domain,
+                "nprobe": item.nprobe,
+                "ef_search": item.ef_search,
+                "mode": item.mode,
+                "cursor": False
+            } for index, item in chunk if index not in invalid]
+            
+            error = None
+            try:
+                search_pages = iter(await asyncio.to_thread(
+                    PROFILER.call, "search_batch", engine.search_batch, requests
+                ) if requests else [])
+            except Exception as e:
+                error = str(e)
+            
+            output = []
+            for index, item in chunk:
+                line = {"index": index, "id": item.id, "query": item.q}
+                if index in invalid:
+                    line["error"] = f"mode must be one of {', '.join(SEARCH_MODES)}"
+                elif error is not None:
+                    line["error"] = error
+                else:
+                    search_page = next(search_pages)
+                    line.update(
+                        results=[{"url": url, "score": float(score), "snippet": snippet, "highlights": highlights}
+                                 for url, score, snippet, highlights in search_page["results"]],
+                        total=search_page["total"],
+                        page=search_page["page"]
+                    )
+                output.append(json.dumps(line) + "\n")
+            yield "".join(output)
     
-    log_search(q, len(formatted_results), time_taken)
-    return response
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.get("/websites", response_model=List[WebsiteResponse])
 async def get_websites():
-    websites = load_websites()
-    return websites
+    return registry.list_websites()
 
 @app.post("/websites", response_model=WebsiteResponse)
-async def add_website(website: Website, background_tasks: BackgroundTasks):
-    websites = load_websites()
-    
-    for existing in websites:
-        if existing["url"] == str(website.url):
-            raise HTTPException(status_code=400, detail="Website already exists")
-    
+async def add_website(website: Website):
     website_id = str(uuid.uuid4())
     website_data = {
         "id": website_id,
@@ -266,57 +663,136 @@ async def add_website(website: Website, background_tasks: BackgroundTasks):
         "created_at": datetime.now().isoformat()
     }
     
-    websites.append(website_data)
-    save_websites(websites)
+    if not registry.add_website(website_data):
+        raise HTTPException(status_code=400, detail="Website already exists")
     
-    background_tasks.add_task(crawl_website_background, website_id, website_data)
+    start_crawl_job(website_id, website_data)
     
     return WebsiteResponse(**website_data)
 
 @app.delete("/websites/{website_id}")
 async def delete_website(website_id: str):
-    websites = load_websites()
-    websites = [w for w in websites if w["id"] != website_id]
-    save_websites(websites)
+    for job in registry.active_jobs(website_id):
+        cancel_crawl_job(job["id"])
+    registry.remove_website(website_id)
+    if os.path.exists(checkpoint_path(website_id)):
+        os.remove(checkpoint_path(website_id))
     return {"message": "Website deleted"}
 
 @app.post("/websites/{website_id}/recrawl")
-async def recrawl_website(website_id: str, background_tasks: BackgroundTasks):
-    websites = load_websites()
-    website = next((w for w in websites if w["id"] == website_id), None)
+async def recrawl_website(
+    website_id: str,
+    resume: bool = Query(True, description="Resume an interrupted crawl from its checkpoint")
+):
+    website = registry.get_website(website_id)
     
     if not website:
         raise HTTPException(status_code=404, detail="Website not found")
     
-    website["status"] = "pending"
-    save_websites(websites)
+    if registry.active_jobs(website_id):
+        raise HTTPException(status_code=409, detail="A crawl of this website is already queued or running")
     
-    background_tasks.add_task(crawl_website_background, website_id, website)
+    resuming = resume and os.path.exists(checkpoint_path(website_id))
+    job_id = start_crawl_job(website_id, website, fresh=not resume)
+    if job_id is None:
+        raise HTTPException(status_code=409, detail="A crawl of this website is already queued or running")
     
-    return {"message": "Recrawl started"}
+    return {"message": "Recrawl resumed" if resuming else "Recrawl started", "job_id": job_id}
 
 @app.get("/crawl-jobs", response_model=List[CrawlJob])
 async def get_crawl_jobs():
-    return list(crawl_jobs.values())
+    return registry.list_jobs()
+
+def cancel_crawl_job(job_id: str) -> Optional[str]:
+    outcome = get_crawl_pool().cancel(job_id)
+    if outcome == "dequeued":
+        job = registry.update_job(job_id, status="cancelled", completed_at=datetime.now().isoformat())
+        registry.update_website(job["website_id"], status="cancelled")
+    return outcome
+
+@app.post("/crawl-jobs/{job_id}/cancel")
+async def cancel_crawl(job_id: str):
+    job = registry.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Crawl job not found")
+    if job["status"] not in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Crawl job is already {job['status']}")
+    
+    cancel_crawl_job(job_id)
+    return {"message": "Crawl job cancelled", "status": registry.get_job(job_id)["status"]}
 
 @app.get("/popular", response_model=Dict[str, int])
-async def popular_queries(limit: int = Query(10, ge=1, le=100)):
-    sorted_queries = sorted(
-        search_stats["popular_queries"].items(), 
-        key=lambda x: x[1], 
-        reverse=True
-    )
-    return dict(sorted_queries[:limit])
+async def popular_queries(limit: int = Query(10, ge=1, le=100), window: str = Query("all")):
+    if window != "all" and window not in WINDOW_SPANS:
+        raise HTTPException(status_code=400, detail=f"window must be one of: all, {', '.join(WINDOW_SPANS)}")
+    return dict(analytics.top(limit, window))
+
+@app.get("/shards")
+async def get_shards():
+    if not num_shards:
+        raise HTTPException(status_code=404, detail="Sharding is not enabled, set KOALA_SHARDS")
+    engine = await asyncio.to_thread(get_sharded_engine)
+    return {
+        "strategy": engine.strategy,
+        "shards": await asyncio.to_thread(engine.shard_stats)
+    }
+
+@app.post("/shards")
+async def add_shard():
+    if not num_shards:
+        raise HTTPException(status_code=404, detail="Sharding is not enabled, set KOALA_SHARDS")
+    engine = await asyncio.to_thread(get_sharded_engine)
+    return await asyncio.to_thread(engine.add_shard)
+
+def collect_crawl_jobs() -> Dict:
+    return {(("status", status),): count for status, count in registry.count_jobs().items()}
+
+def collect_index_size() -> Dict:
+    if search_engine is None:
+        return {}
+    return {(("kind", kind),): count for kind, count in search_engine.index_stats().items()}
+
+def collect_cache_hit_ratio() -> Dict:
+    if search_engine is None:
+        return {}
+    stats = search_engine.cache_stats()
+    return {(("cache", name),): stats[name]["hit_rate"] for name in ("query_vectors", "results")}
+
+REGISTRY.gauge("koala_crawl_jobs", "Crawl jobs by status", collect_crawl_jobs)
+REGISTRY.gauge("koala_index_size", "Indexed documents and passages", collect_index_size)
+REGISTRY.gauge("koala_search_cache_hit_ratio", "Hit ratio of the query-vector and result caches", collect_cache_hit_ratio)
+
+PROFILER.sample_rate = float(os.getenv("KOALA_PROFILE_SAMPLE_RATE", "0"))
+PROFILER.slow_seconds = float(os.getenv("KOALA_PROFILE_SLOW_MS", "500")) / 1000
+PROFILER.output_dir = os.getenv("KOALA_PROFILE_DIR") or None
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Index-size and cache gauges query the engine (and shard processes), so rendering runs off the loop.
+    body = await asyncio.to_thread(REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/slow-profiles")
+async def slow_profiles():
+    return PROFILER.recent()
+
+# Cache stats may round-trip to shard processes and the near-duplicate index waits on its lock
+# while a crawl is ingesting, so both are read off the event loop.
+def index_side_stats() -> Dict:
+    return {
+        "search_cache": search_engine.cache_stats() if search_engine else None,
+        "near_duplicates": get_near_duplicates().stats()
+    }
 
 @app.get("/stats")
 async def get_stats():
-    websites = load_websites()
     return {
-        "total_searches": search_stats["total_searches"],
-        "recent_searches_count": len(search_stats["recent_searches"]),
-        "unique_queries": len(search_stats["popular_queries"]),
-        "total_websites": len(websites),
-        "active_crawls": len([j for j in crawl_jobs.values() if j["status"] == "running"])
+        **analytics.stats(),
+        "total_websites": len(registry.websites),
+        "active_crawls": registry.count_jobs().get("running", 0),
+        "crawl_pool": get_crawl_pool().stats(),
+        "search_batching": search_batcher.stats() if search_batcher else None,
+        **await asyncio.to_thread(index_side_stats)
     }
 
 if __name__ == "__main__":
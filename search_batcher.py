@@ -0,0 +1,90 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional, Set, TYPE_CHECKING
+from metrics import SEARCH_STAGE, BATCH_SIZE, PROFILER
+
+if TYPE_CHECKING:
+    from search_engine import SearchEngine
+
+class SearchBatcher:
+    def __init__(self, engine: 'SearchEngine', max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, workers: int = 2):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="koala-search")
+        self.queue: Optional[asyncio.Queue] = None
+        self.collector: Optional[asyncio.Task] = None
+        self.dispatches: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.queries = 0
+
+    async def search(self, **request) -> Dict:
+        if self.collector is None:
+            self.queue = asyncio.Queue()
+            self.collector = asyncio.create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self.dispatches.add(task)
+            task.add_done_callback(self.dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Dict, asyncio.Future, float]]):
+        now = time.perf_counter()
+        for _, _, enqueued in batch:
+            SEARCH_STAGE.observe(now - enqueued, stage="batch_wait")
+        batch = [(request, future) for request, future, _ in batch if not future.done()]
+        if not batch:
+            return
+        self.batches += 1
+        self.queries += len(batch)
+        BATCH_SIZE.observe(len(batch))
+
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.pool, PROFILER.call, "search_batch", self.engine.search_batch, [request for request, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0
+        }
+
+    async def close(self):
+        if self.collector is not None:
+            self.collector.cancel()
+            await asyncio.gather(self.collector, return_exceptions=True)
+            self.collector = None
+        self.pool.shutdown(wait=False)
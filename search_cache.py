@@ -0,0 +1,53 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def items(self) -> List[tuple]:
+        now = time.monotonic()
+        with self.lock:
+            return [(key, entry[1]) for key, entry in self.entries.items() if entry[0] >= now]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
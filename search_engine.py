@@ -1,107 +1,623 @@
 import os
+import re
 import json
+import base64
+import secrets
+import threading
 import faiss
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Optional
+import numpy as np
+from collections import defaultdict
+from typing import List, Tuple, Optional, Dict
+from search_cache import LRUCache
+from snippets import make_snippet
+from metrics import SEARCH_STAGE, CRAWL_STAGE
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from document_store import DocumentStore, passage_id, normalize_domain, host_matches
+from vector_store import (
+    INDEX_TYPES, QUANTIZED_TYPES, VectorStore, build_index, rerank, default_nlist, exact_search, load_index, min_train_size,
+    search_params, supports_remove, supports_selector, write_index, TRAINED_TYPES
+)
+
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+# A full sync retrains a learned index once the corpus is this many times the size it was trained on.
+RETRAIN_GROWTH = 4
+
+def chunk_passages(text: str, passage_words: int = 128, overlap: int = 32) -> List[Tuple[int, int]]:
+    words = [match.span() for match in re.finditer(r'\S+', text)]
+    if not words:
+        return []
+    stride = max(1, passage_words - overlap)
+    spans = []
+    for start in range(0, len(words), stride):
+        window = words[start:start + passage_words]
+        spans.append((window[0][0], window[-1][1]))
+        if start + passage_words >= len(words):
+            break
+    return spans
+
+def encode_cursor(list_id: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{list_id}:{offset}".encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        list_id, offset = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii').rsplit(':', 1)
+        offset = int(offset)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return list_id, offset
 
 class SearchEngine:
-    def __init__(self, data_path, cache_path='vector_index'):
-        with open(data_path, 'r', encoding='utf-8') as file:
-            self.data = json.load(file)
-
-        if isinstance(self.data[0], list):
-            self.urls = [entry[0] for entry in self.data]
-            self.texts = [entry[1] for entry in self.data]
-            self.metadata = [{"title": "", "description": ""} for _ in self.data]
-        else:
-            self.urls = [entry.get("url", "") for entry in self.data]
-            self.texts = [entry.get("content", "") for entry in self.data]
-            self.metadata = [
-                {
-                    "title": entry.get("title", ""),
-                    "description": entry.get("description", "")
-                }
-                for entry in self.data
-            ]
-
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, documents: DocumentStore, cache_path='vector_index', index_type: str = 'flat',
+                 nlist: Optional[int] = None, nprobe: int = 16, hnsw_m: int = 32,
+                 ef_search: int = 64, pq_m: int = 48, cache_size: int = 1024, cache_ttl: float = 300.0,
+                 passage_words: int = 128, passage_overlap: int = 32, embed_batch_size: int = 64,
+                 exact_filter_threshold: int = 50000, lexical: Optional[BM25Index] = None,
+                 mmap_index: bool = False, rerank_factor: int = 4, max_results: int = 500, encoder=None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+        self.documents = documents
+        self.lexical = lexical
+
+        if encoder is None:
+            # Imported here so that importing this module does not pull in torch.
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = encoder
         self.embedding_dim = 384
-        
+
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.pq_m = pq_m
+        self.passage_words = passage_words
+        self.passage_overlap = passage_overlap
+        self.embed_batch_size = embed_batch_size
+        self.passage_oversample = 3
+        self.exact_filter_threshold = exact_filter_threshold
+        self.mmap_index = mmap_index
+        self.rerank_factor = rerank_factor
+        self.max_results = max_results
+        self.index_mmapped = False
+        self.domain_cache = LRUCache(256, cache_ttl)
+
+        self.lock = threading.RLock()
+        # Serializes sync_index so two callers never embed the same pending documents.
+        self.sync_lock = threading.Lock()
+        self.generation = 0
+        # Domain filters are cached per domain_generation, which only a full sync advances;
+        # incremental syncs add their documents to the cached filters instead.
+        self.domain_generation = 0
+        # Set when an incremental sync dropped vectors an index without remove_ids still holds.
+        self.rebuild_pending = False
+        self.vector_cache = LRUCache(cache_size, cache_ttl)
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        # Ranked lists handed out through cursors; not cleared on index updates, so a client
+        # paging through results sees one consistent ranking.
+        self.cursor_cache = LRUCache(cache_size, cache_ttl)
         self.index_path = f"{cache_path}.index"
+        self.manifest_path = f"{cache_path}.manifest.json"
+        self.vectors = VectorStore(f"{cache_path}.vectors", self.embedding_dim)
+        self.trained_vectors = 0
+        self.trained_nlist: Optional[int] = None
+
         self.create_or_load_index()
-    
+
+    def _target_index_type(self) -> str:
+        nlist = self.nlist or default_nlist(len(self.vectors))
+        if len(self.vectors) < min_train_size(self.index_type, nlist):
+            return "flat"
+        return self.index_type
+
+    def rebuild_index(self):
+        self.active_index_type = self._target_index_type()
+        if self.active_index_type != self.index_type:
+            print(f"[INFO] Corpus too small to train '{self.index_type}', using flat index for now")
+        print(f"[INFO] Building {self.active_index_type} index over {len(self.vectors)} vectors...")
+        nlist = self.nlist or default_nlist(len(self.vectors))
+        self.index = build_index(self.active_index_type, self.embedding_dim, self.vectors,
+                                 nlist=nlist, hnsw_m=self.hnsw_m, pq_m=self.pq_m)
+        self.trained_vectors = len(self.vectors)
+        self.trained_nlist = nlist if self.active_index_type in ("ivf", "ivfpq") else None
+
+    # Streamed ingestion grows the corpus after the quantizer was trained on its first batches;
+    # a full sync retrains once the corpus has outgrown that training set, or once the IVF list
+    # count suited to it is twice the trained one, before lists get long enough to slow nprobe.
+    def _needs_retrain(self) -> bool:
+        if self.active_index_type not in TRAINED_TYPES:
+            return False
+        if len(self.vectors) > RETRAIN_GROWTH * max(1, self.trained_vectors):
+            return True
+        return self.nlist is None and self.trained_nlist is not None and \
+            default_nlist(len(self.vectors)) > 2 * self.trained_nlist
+
+    def _load_manifest(self) -> Optional[Dict]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get("dim") != self.embedding_dim:
+            return None
+        return manifest
+
+    def save_index(self):
+        if self.vectors.total_rows > 2 * len(self.vectors):
+            self.vectors.compact()
+        manifest = {
+            "dim": self.embedding_dim,
+            "index_type": self.active_index_type,
+            "passage_words": self.passage_words,
+            "passage_overlap": self.passage_overlap,
+            "trained_vectors": self.trained_vectors,
+            "nlist": self.trained_nlist
+        }
+        write_index(self.index, self.index_path)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, self.manifest_path)
+
     def create_or_load_index(self):
-        if os.path.exists(self.index_path):
-            print("[INFO] Loading cached vector index...")
-            self.index = faiss.read_index(self.index_path)
+        manifest = self._load_manifest()
+        if manifest is None or manifest.get("passage_words") != self.passage_words \
+                or manifest.get("passage_overlap") != self.passage_overlap:
+            self.documents.clear_embedded()
+
+        # Documents whose passage vectors went missing are re-embedded; vectors without a passage are dropped.
+        passage_ids = set(self.documents.passage_ids())
+        missing = self.documents.get_passages(pid for pid in passage_ids if pid not in self.vectors)
+        self.documents.mark_embedded((doc_id, None) for doc_id in {doc_id for doc_id, _, _ in missing.values()})
+        stale_ids = [pid for pid in self.vectors.ids() if pid not in passage_ids]
+        self.vectors.remove(stale_ids)
+
+        stats = self._index_pending(live=False, show_progress_bar=True)
+        print(f"[INFO] Index sync: {stats['embedded']} documents ({stats['passages']} passages) embedded, "
+              f"{len(stale_ids) + stats['removed']} passages removed")
+
+        if (manifest is not None and not stale_ids and not stats["embedded"] and not stats["removed"]
+                and os.path.exists(self.index_path)
+                and manifest.get("index_type") == self._target_index_type()):
+            print(f"[INFO] Loading cached vector index{' (memory-mapped)' if self.mmap_index else ''}...")
+            self.index = load_index(self.index_path, mmap=self.mmap_index)
+            self.index_mmapped = self.mmap_index
+            self.active_index_type = manifest["index_type"]
+            self.trained_vectors = manifest.get("trained_vectors", len(self.vectors))
+            # Manifests written before nlist was recorded: ask the IVF index itself.
+            self.trained_nlist = manifest.get("nlist") or (
+                self.index.nlist if self.active_index_type in ("ivf", "ivfpq") else None)
+            # An index file written before later unpersisted updates (see sync_index) is behind the vector store.
+            if self.index.ntotal != len(self.vectors):
+                self.rebuild_index()
+                self.save_index()
         else:
-            print("[INFO] Creating new vector index...")
-            self.index = faiss.IndexFlatIP(self.embedding_dim)
-            
-            embeddings = self.model.encode(self.texts, show_progress_bar=True)
-            embeddings = embeddings.astype('float32')
-            faiss.normalize_L2(embeddings)
-            self.index.add(embeddings)
-            
-            faiss.write_index(self.index, self.index_path)
-    
-    def search(self, query: str, top_k: int = 5, sort_by: str = 'score', 
-               page: int = 1, per_page: int = 5, domain: Optional[str] = None) -> List[Tuple[str, float, str]]:
-        query_vector = self.model.encode([query]).astype('float32')
-        faiss.normalize_L2(query_vector)
-        
-        k = min(len(self.texts), top_k * per_page * 2)
-        distances, indices = self.index.search(query_vector, k)
-        
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.urls):
-                url = self.urls[idx]
-                score = float(distances[0][i])
-                text = self.texts[idx]
-                
-                if domain and domain not in url:
+            self.rebuild_index()
+            self.save_index()
+
+    def _encode_texts(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.embedding_dim), dtype='float32')
+        embeddings = self.model.encode(texts, batch_size=self.embed_batch_size,
+                                       show_progress_bar=show_progress_bar)
+        embeddings = embeddings.astype('float32')
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _drop_passages(self, passage_ids: List[int], live: bool):
+        if not passage_ids:
+            return
+        with self.lock:
+            self.vectors.remove(passage_ids)
+            if live and supports_remove(self.active_index_type):
+                self.index.remove_ids(np.asarray(passage_ids, dtype='int64'))
+        self.documents.delete_passages(passage_ids)
+
+    def _index_pending(self, live: bool, show_progress_bar: bool = False,
+                       doc_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        stats = {"embedded": 0, "passages": 0, "removed": 0}
+
+        if doc_ids is None:
+            orphan_ids = self.documents.orphan_passage_ids()
+        else:
+            # Only the given documents are checked; those no longer stored lose their passages.
+            gone = set(doc_ids) - self.documents.present_ids(doc_ids)
+            orphan_ids = self.documents.passage_ids_for(gone) if gone else []
+        self._drop_passages(orphan_ids, live)
+        stats["removed"] += len(orphan_ids)
+
+        # Documents are pulled in small batches and their passages encoded in fixed-size
+        # batches that go straight to the vector store, so peak memory does not grow with the corpus.
+        for batch in self.documents.pending_embeddings(self.embed_batch_size, doc_ids):
+            chunk_ids = [doc_id for doc_id, _, _ in batch]
+            old_ids = self.documents.passage_ids_for(chunk_ids)
+            self._drop_passages(old_ids, live)
+            stats["removed"] += len(old_ids)
+
+            rows, texts = [], []
+            for doc_id, _, text in batch:
+                for number, (start, end) in enumerate(chunk_passages(text, self.passage_words, self.passage_overlap)):
+                    rows.append((passage_id(doc_id, number), doc_id, start, end))
+                    texts.append(text[start:end])
+
+            for start in range(0, len(rows), self.embed_batch_size):
+                ids = [row[0] for row in rows[start:start + self.embed_batch_size]]
+                with CRAWL_STAGE.time(stage="embed"):
+                    embeddings = self._encode_texts(texts[start:start + self.embed_batch_size], show_progress_bar)
+                with self.lock, CRAWL_STAGE.time(stage="index"):
+                    self.vectors.append(ids, embeddings)
+                    if live:
+                        self.index.add_with_ids(embeddings, np.asarray(ids, dtype='int64'))
+
+            self.documents.replace_passages(chunk_ids, rows)
+            self.documents.mark_embedded((doc_id, doc_hash) for doc_id, doc_hash, _ in batch)
+            stats["embedded"] += len(batch)
+            stats["passages"] += len(rows)
+        return stats
+
+    def _ensure_writable(self):
+        # A memory-mapped index is read-only; the first update swaps in an in-memory copy.
+        with self.lock:
+            if self.index_mmapped:
+                self.index = load_index(self.index_path)
+                self.index_mmapped = False
+
+    def warm_up(self):
+        query_vectors = self._encode_texts(["warm up"])
+        with self.lock:
+            self._search_vectors(query_vectors, 1, None, None, None)
+
+    # Streaming ingestion passes persist=False and the batch's doc_ids for intermediate batches;
+    # the vectors are durable either way and a stale index file is rebuilt on load. Rebuilds,
+    # including the switch to the configured index type once the corpus can train it, wait for
+    # the next full sync; until then ids an hnsw index still holds for dropped passages are
+    # skipped when ranking.
+    def sync_index(self, persist: bool = True, doc_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        with self.sync_lock:
+            self._ensure_writable()
+            stats = self._index_pending(live=True, doc_ids=doc_ids)
+
+            with self.lock:
+                removed = stats["removed"] and not supports_remove(self.active_index_type)
+                if doc_ids is not None:
+                    self.rebuild_pending = self.rebuild_pending or bool(removed)
+                elif self._target_index_type() != self.active_index_type or removed or self.rebuild_pending \
+                        or self._needs_retrain():
+                    self.rebuild_index()
+                    self.rebuild_pending = False
+                self.generation += 1
+                self.result_cache.clear()
+                if doc_ids is None:
+                    self.domain_generation += 1
+                if persist:
+                    self.save_index()
+            if doc_ids is not None:
+                self._extend_domain_cache(doc_ids)
+
+        return stats
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        query_vectors = np.empty((len(queries), self.embedding_dim), dtype='float32')
+        missing: Dict[str, List[int]] = defaultdict(list)
+        for position, query in enumerate(queries):
+            cached = self.vector_cache.get(query)
+            if cached is None:
+                missing[query].append(position)
+            else:
+                query_vectors[position] = cached
+
+        if missing:
+            with SEARCH_STAGE.time(stage="encode"):
+                encoded = self.model.encode(list(missing)).astype('float32')
+                faiss.normalize_L2(encoded)
+            for (query, positions), vector in zip(missing.items(), encoded):
+                self.vector_cache.put(query, vector)
+                query_vectors[positions] = vector
+        return query_vectors
+
+    def search(self, query: str, sort_by: str = 'score', page: int = 1, per_page: int = 5,
+               domain: Optional[str] = None, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               mode: str = 'vector') -> List[Tuple[str, float, str, List[Tuple[int, int]]]]:
+        return self.search_batch([{
+            "query": query, "sort_by": sort_by, "page": page, "per_page": per_page,
+            "domain": domain, "nprobe": nprobe, "ef_search": ef_search, "mode": mode
+        }])[0]["results"]
+
+    # Serves the page after a previous response from its stored ranked list, without
+    # encoding, index search or ranking.
+    def search_cursor(self, cursor: str, per_page: int = 5) -> Dict:
+        list_id, offset = decode_cursor(cursor)
+        ranked = self.cursor_cache.get(list_id)
+        if ranked is None:
+            raise ValueError("Cursor has expired, repeat the search")
+        with SEARCH_STAGE.time(stage="snippet"):
+            return self._paginate(ranked, {"per_page": per_page}, offset)
+
+    # Each request is ranked once to max_results and the ranked list is stored, so later
+    # pages come from search_cursor with the returned next_cursor.
+    def search_batch(self, requests: List[Dict]) -> List[Dict]:
+        ranked_lists = self.rank_batch(requests)
+        with SEARCH_STAGE.time(stage="snippet"):
+            return [self._paginate(ranked, request) for ranked, request in zip(ranked_lists, requests)]
+
+    # Ranked lists without snippets: {"id", "query", "hits": [(doc_id, url, score, span)], "total"}.
+    def rank_batch(self, requests: List[Dict]) -> List[Dict]:
+        results: List[Dict] = [{} for _ in requests]
+        misses = []
+        # Read once: rankings computed while a sync lands are stored under the generations they
+        # started from, so the next lookup after the sync misses instead of reusing them.
+        generations = (self.generation, self.lexical.generation if self.lexical is not None else None)
+        for position, request in enumerate(requests):
+            mode = request.get("mode", "vector")
+            if mode not in SEARCH_MODES:
+                raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+            if mode != "vector" and self.lexical is None:
+                raise ValueError(f"Search mode '{mode}' needs a lexical index")
+            ranked = self.result_cache.get(self._result_key(request, generations))
+            if ranked is None:
+                misses.append(position)
+            else:
+                results[position] = ranked
+        if not misses:
+            return results
+
+        vector_positions = [p for p in misses if requests[p].get("mode", "vector") != "bm25"]
+        vector_ranked = self._vector_search(requests, vector_positions)
+        for position in misses:
+            request = requests[position]
+            mode = request.get("mode", "vector")
+            if mode == "vector":
+                hits = vector_ranked.get(position, [])
+                total = len(hits)
+            elif mode == "bm25":
+                with SEARCH_STAGE.time(stage="bm25"):
+                    hits, total = self._lexical_rank(request)
+            else:
+                with SEARCH_STAGE.time(stage="bm25"):
+                    lexical_ranked, lexical_total = self._lexical_rank(request)
+                with SEARCH_STAGE.time(stage="fuse"):
+                    hits, total = self._fuse(request, vector_ranked.get(position, []), lexical_ranked,
+                                             lexical_total)
+            ranked = {"id": secrets.token_urlsafe(12), "query": request["query"], "hits": hits, "total": total}
+            self.result_cache.put(self._result_key(request, generations), ranked)
+            results[position] = ranked
+        return results
+
+    def _vector_search(self, requests: List[Dict], positions: List[int]) -> Dict[int, List[Tuple]]:
+        ranked: Dict[int, List[Tuple]] = {}
+        if not positions:
+            return ranked
+        query_vectors = self.encode_queries([requests[p]["query"] for p in positions])
+        vector_rows = {position: row for row, position in enumerate(positions)}
+
+        groups: Dict[Tuple, List[int]] = defaultdict(list)
+        for position in positions:
+            request = requests[position]
+            groups[(request.get("nprobe"), request.get("ef_search"), request.get("domain"))].append(position)
+
+        with self.lock:
+            for (nprobe, ef_search, domain), group in groups.items():
+                # Several passages of one page can match, so over-fetch passages before collapsing to pages.
+                k = self.max_results * self.passage_oversample
+                with SEARCH_STAGE.time(stage="index_search"):
+                    distances, indices = self._search_vectors(
+                        query_vectors[[vector_rows[p] for p in group]], k, nprobe, ef_search, domain
+                    )
+                if indices.shape[1] == 0:
                     continue
-                    
-                snippet = self.search_snippet(text, query)
-                results.append((url, score, snippet))
-        
+                for row, position in enumerate(group):
+                    with SEARCH_STAGE.time(stage="rank"):
+                        ranked[position] = self._rank(requests[position], distances[row],
+                                                      indices[row])[:self.max_results]
+        return ranked
+
+    def _extend_domain_cache(self, doc_ids: List[int]):
+        cached = [(key, ids) for key, ids in self.domain_cache.items() if key[1] == self.domain_generation]
+        if not cached:
+            return
+        urls = {doc_id: doc["url"] for doc_id, doc in self.documents.get_many(doc_ids).items()}
+        for (kind, generation, domain), ids in cached:
+            matched = [doc_id for doc_id, url in urls.items() if host_matches(url, domain)]
+            if kind == "passages":
+                matched = self.documents.passage_ids_for(matched) if matched else []
+            if matched:
+                self.domain_cache.put((kind, generation, domain),
+                                      np.union1d(ids, np.asarray(matched, dtype='int64')))
+
+    def _domain_doc_ids(self, domain: str) -> np.ndarray:
+        key = ("docs", self.domain_generation, normalize_domain(domain))
+        ids = self.domain_cache.get(key)
+        if ids is None:
+            ids = np.asarray(self.documents.doc_ids_for_domain(domain), dtype='int64')
+            self.domain_cache.put(key, ids)
+        return ids
+
+    def _lexical_rank(self, request: Dict) -> Tuple[List[Tuple[int, str, float, Optional[Tuple[int, int]]]], int]:
+        domain = request.get("domain")
+        allowed_ids = self._domain_doc_ids(domain) if domain else None
+        scores, doc_ids, total = self.lexical.search(request["query"], self.max_results, allowed_ids)
+        docs = self.documents.get_many(int(doc_id) for doc_id in doc_ids)
+        results = [(int(doc_id), docs[int(doc_id)]["url"], float(score), None)
+                   for score, doc_id in zip(scores, doc_ids) if int(doc_id) in docs]
+        return self._sort(results, request.get("sort_by", "score")), total
+
+    def _fuse(self, request: Dict, vector_ranked: List[Tuple], lexical_ranked: List[Tuple],
+              lexical_total: int) -> Tuple[List[Tuple[int, str, float, Optional[Tuple[int, int]]]], int]:
+        # Reciprocal rank fusion only looks at positions, so cosine and BM25 scores need no calibration.
+        # Vector hits keep their best passage for the snippet; lexical-only hits use the whole page.
+        hits = {hit[0]: hit for hit in lexical_ranked}
+        hits.update({hit[0]: hit for hit in vector_ranked})
+        fused = reciprocal_rank_fusion([[hit[0] for hit in vector_ranked], [hit[0] for hit in lexical_ranked]])
+        results = [(doc_id, hits[doc_id][1], score, hits[doc_id][3])
+                   for doc_id, score in fused[:self.max_results]]
+        # Lexical matches ranked below max_results still count towards the total.
+        total = len(fused) + max(0, lexical_total - len(lexical_ranked))
+        return self._sort(results, request.get("sort_by", "score")), total
+
+    def _domain_passage_ids(self, domain: str) -> np.ndarray:
+        key = ("passages", self.domain_generation, normalize_domain(domain))
+        ids = self.domain_cache.get(key)
+        if ids is None:
+            ids = np.asarray(self.documents.passage_ids_for_domain(domain), dtype='int64')
+            self.domain_cache.put(key, ids)
+        return ids
+
+    def _search_vectors(self, query_vectors: np.ndarray, k: int, nprobe: Optional[int],
+                        ef_search: Optional[int], domain: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        if not domain:
+            k = min(self.index.ntotal, k)
+            if k == 0:
+                return np.empty((len(query_vectors), 0)), np.empty((len(query_vectors), 0), dtype='int64')
+            params = search_params(self.active_index_type, nprobe or self.nprobe, ef_search or self.ef_search)
+            return self._index_search(query_vectors, k, params)
+
+        # The domain filter is applied inside retrieval: small domains are scanned exactly
+        # from the stored vectors, larger ones go through the index restricted by an ID selector.
+        ids = self._domain_passage_ids(domain)
+        if len(ids) <= self.exact_filter_threshold:
+            return exact_search(self.vectors, ids, query_vectors, k)
+
+        k = min(len(ids), k)
+        if not supports_selector(self.active_index_type):
+            return self._post_filter_search(query_vectors, k, ids)
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        params = search_params(self.active_index_type, nprobe or self.nprobe, ef_search or self.ef_search,
+                               sel=selector)
+        return self._index_search(query_vectors, k, params)
+
+    # Without selector support the index is searched unfiltered, deep enough for the domain's
+    # share of it to yield rerank_factor x k candidates, which are filtered and re-ranked.
+    def _post_filter_search(self, query_vectors: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        share = len(ids) / max(1, self.index.ntotal)
+        fetch = min(self.index.ntotal, int(np.ceil(k * max(1, self.rerank_factor) / share)))
+        _, candidates = self.index.search(query_vectors, fetch)
+        candidates = np.where(np.isin(candidates, ids), candidates, -1)
+        return rerank(self.vectors, query_vectors, candidates, k)
+
+    def _index_search(self, query_vectors: np.ndarray, k: int, params) -> Tuple[np.ndarray, np.ndarray]:
+        if self.active_index_type not in QUANTIZED_TYPES or self.rerank_factor <= 1:
+            return self.index.search(query_vectors, k, params=params)
+        # Candidates come from the compressed codes; the final order uses full-precision
+        # vectors read from the memory-mapped store, so only the candidates are paged in.
+        _, candidates = self.index.search(query_vectors, min(self.index.ntotal, k * self.rerank_factor), params=params)
+        return rerank(self.vectors, query_vectors, candidates, k)
+
+    def _result_key(self, request: Dict, generations: Tuple[int, Optional[int]]) -> Tuple:
+        mode = request.get("mode", "vector")
+        generation, lexical_generation = generations
+        if mode == "vector":
+            lexical_generation = None
+        return (generation, lexical_generation, mode, request["query"], request.get("domain"),
+                request.get("sort_by", "score"), request.get("nprobe"),
+                request.get("ef_search"))
+
+    def _rank(self, request: Dict, distances: np.ndarray,
+              indices: np.ndarray) -> List[Tuple[int, str, float, Tuple[int, int]]]:
+        domain = request.get("domain")
+        sort_by = request.get("sort_by", "score")
+        passages = self.documents.get_passages(pid for pid in indices if pid >= 0)
+        docs = self.documents.get_many({doc_id for doc_id, _, _ in passages.values()})
+
+        results = []
+        seen_docs = set()
+        for i, pid in enumerate(indices):
+            passage = passages.get(int(pid))
+            if passage is None:
+                continue
+            doc_id, passage_start, passage_end = passage
+            doc = docs.get(doc_id)
+            # Hits come best-first, so the first passage seen for a page is its best one.
+            if doc is None or doc_id in seen_docs:
+                continue
+            seen_docs.add(doc_id)
+            url = doc["url"]
+            score = float(distances[i])
+
+            if domain and not host_matches(url, domain):
+                continue
+
+            results.append((doc_id, url, score, (passage_start, passage_end)))
+
+        return self._sort(results, sort_by)
+
+    def _sort(self, results: List[Tuple], sort_by: str) -> List[Tuple]:
         if sort_by == 'score':
-            results.sort(key=lambda x: x[1], reverse=True)
+            results.sort(key=lambda x: x[2], reverse=True)
         elif sort_by == 'relevance':
-            results.sort(key=lambda x: x[1], reverse=False)
-            
-        start = (page - 1) * per_page
-        end = start + per_page
-        
-        return results[start:end]
-    
+            results.sort(key=lambda x: x[2], reverse=False)
+        return results
+
+    def _paginate(self, ranked: Dict, request: Dict, offset: Optional[int] = None) -> Dict:
+        per_page = request.get("per_page", 5)
+        if offset is None:
+            offset = (request.get("page", 1) - 1) * per_page
+        hits = ranked["hits"]
+        # Bulk requests opt out of cursors so they do not evict interactive users' ranked lists.
+        keep_cursor = request.get("cursor", True)
+        if keep_cursor:
+            self.cursor_cache.put(ranked["id"], ranked)
+
+        # Snippets are built only for the page being returned.
+        results = []
+        for doc_id, url, score, span in hits[offset:offset + per_page]:
+            snippet, highlights = self.snippet(doc_id, ranked["query"], span)
+            results.append((url, score, snippet, highlights))
+        next_offset = offset + per_page
+        return {
+            "results": results,
+            "total": ranked["total"],
+            "page": offset // per_page + 1,
+            "next_cursor": encode_cursor(ranked["id"], next_offset) if keep_cursor and next_offset < len(hits) else None
+        }
+
+    def index_stats(self) -> Dict[str, int]:
+        return {"documents": len(self.documents), "passages": len(self.vectors)}
+
+    def cache_stats(self) -> Dict:
+        return {
+            "generation": self.generation,
+            "query_vectors": self.vector_cache.stats(),
+            "results": self.result_cache.stats()
+        }
+
+    def snippet(self, doc_id: int, query: str,
+                span: Optional[Tuple[int, int]] = None) -> Tuple[str, List[Tuple[int, int]]]:
+        offsets = self.lexical.snippet_offsets(doc_id, query) if self.lexical is not None else None
+        with self.documents.open_text(doc_id) as text:
+            if offsets is None:
+                # No precomputed offsets (no lexical index, or not synced yet): plain substring match.
+                return self.search_snippet(text[span[0]:span[1]] if span is not None else str(text), query), []
+            starts, term_offsets = offsets
+            return make_snippet(text, starts, term_offsets, span)
+
     def search_snippet(self, text, query, window_size=50):
         query_lower = query.lower()
         text_lower = text.lower()
-        
+
         index = text_lower.find(query_lower)
         if index == -1:
             return text[:2*window_size] + ("..." if len(text) > 2*window_size else "")
-        
+
         start = max(index - window_size, 0)
         end = min(index + len(query) + window_size, len(text))
-        
+
         snippet = text[start:end]
-        
+
         if start > 0:
             snippet = "..." + snippet
         if end < len(text):
             snippet = snippet + "..."
-            
+
         return snippet
 
 if __name__ == "__main__":
-    search_engine = SearchEngine('prepared_data.json')
+    search_engine = SearchEngine(DocumentStore('documents'))
     while True:
         query = input("Enter your search query: ")
         if query.lower() == "exit":
             break
         results = search_engine.search(query)
-        for url, score, snippet in results:
+        for url, score, snippet, _ in results:
             print(f"{url} - Score: {score:.4f}\nSnippet: {snippet}\n")
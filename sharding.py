@@ -0,0 +1,369 @@
+import os
+import json
+import hashlib
+import secrets
+import threading
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from search_cache import LRUCache
+from metrics import SEARCH_STAGE
+from search_engine import SearchEngine, encode_cursor, decode_cursor
+from document_store import DocumentStore, normalize_domain, url_to_id
+
+SHARD_STRATEGIES = ("hash", "domain")
+
+def shard_key(url: str, strategy: str) -> str:
+    return normalize_domain(urlparse(url).netloc) if strategy == "domain" else url
+
+# Rendezvous (highest random weight) hashing: adding a shard only moves the documents the
+# new shard wins, about 1/n of the corpus, and every other assignment stays put.
+def assign_shard(url: str, shard_names: List[str], strategy: str) -> str:
+    key = shard_key(url, strategy)
+    return max(shard_names, key=lambda name: hashlib.blake2b(f"{name}:{key}".encode('utf-8'), digest_size=8).digest())
+
+# Runs in the shard's worker process: its own document store, lexical index and search
+# engine under `path`. The query and update connections are served by separate threads so
+# an ingest does not hold up searches.
+def shard_main(path: str, query_conn, update_conn, engine_options: Dict):
+    from bm25_index import BM25Index
+
+    os.makedirs(path, exist_ok=True)
+    store = DocumentStore(os.path.join(path, "documents"))
+    lexical = BM25Index(os.path.join(path, "lexical_index.db"))
+    lexical.sync(store)
+    engine_lock = threading.Lock()
+    engine = None
+
+    def get_engine():
+        nonlocal engine
+        with engine_lock:
+            if engine is None and len(store):
+                engine = SearchEngine(store, cache_path=os.path.join(path, "vector_index"), lexical=lexical,
+                                      **engine_options)
+        return engine
+
+    def rank(requests: List[Dict]) -> List[Dict]:
+        current = get_engine()
+        if current is None:
+            return [{"hits": [], "total": 0} for _ in requests]
+        return [{"hits": ranked["hits"], "total": ranked["total"]} for ranked in current.rank_batch(requests)]
+
+    def snippets(items: List[Tuple[int, str, Optional[Tuple[int, int]]]]) -> List[Tuple[str, List]]:
+        current = get_engine()
+        return [current.snippet(doc_id, query, span) if current else ("", []) for doc_id, query, span in items]
+
+    def ingest(pages: List[Dict], delete_urls: List[str], validators: Dict[str, Dict],
+               incremental: bool = False) -> Dict:
+        stats = store.put_many(pages)
+        stats["removed"] = len(store.delete(delete_urls))
+        if validators:
+            store.put_validators(validators)
+        if incremental:
+            doc_ids = [url_to_id(page["url"]) for page in pages] + [url_to_id(url) for url in delete_urls]
+            lexical.sync(store, doc_ids=doc_ids)
+        else:
+            store.compact()
+            lexical.sync(store)
+        return stats
+
+    # doc_ids are those of a streamed batch across all shards; ids this shard does not hold are
+    # absent from its store and cost one lookup each.
+    def sync(persist: bool = True, doc_ids: Optional[List[int]] = None) -> Dict:
+        current = get_engine()
+        return current.sync_index(persist, doc_ids) if current else {"embedded": 0, "passages": 0, "removed": 0}
+
+    def warm_up():
+        current = get_engine()
+        if current is not None:
+            current.warm_up()
+
+    def moved_urls(shard_names: List[str], strategy: str, own_name: str) -> List[str]:
+        with store.lock:
+            urls = [url for (url,) in store.conn.execute("SELECT url FROM docs")]
+        return [url for url in urls if assign_shard(url, shard_names, strategy) != own_name]
+
+    def export(urls: List[str]) -> Tuple[List[Dict], Dict[str, Dict]]:
+        entries = [store.get_document(url_to_id(url)) for url in urls]
+        validators = {}
+        for url in urls:
+            validators.update({u: v for u, v in store.validators_with_prefix(url).items() if u == url})
+        return [entry for entry in entries if entry is not None], validators
+
+    # Stats report on the engine as it is; a shard that has not built one yet reports no passages.
+    def stats() -> Dict:
+        return {
+            "documents": len(store),
+            "passages": len(engine.vectors) if engine else 0,
+            "cache": engine.cache_stats() if engine else None
+        }
+
+    handlers: Dict[str, Callable] = {
+        "rank": rank, "snippets": snippets, "ingest": ingest, "sync": sync, "warm_up": warm_up,
+        "moved_urls": moved_urls, "export": export, "stats": stats,
+        "validators": store.validators_with_prefix, "urls": store.urls_with_prefix
+    }
+
+    def serve(conn):
+        while True:
+            try:
+                command, args = conn.recv()
+            except EOFError:
+                return
+            if command == "close":
+                conn.send(("ok", None))
+                return
+            try:
+                conn.send(("ok", handlers[command](*args)))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    updates = threading.Thread(target=serve, args=(update_conn,), daemon=True)
+    updates.start()
+    serve(query_conn)
+    updates.join(timeout=5)
+    store.close()
+
+class ShardClient:
+    def __init__(self, name: str, path: str, engine_options: Dict, context):
+        self.name = name
+        self.query_conn, query_child = context.Pipe()
+        self.update_conn, update_child = context.Pipe()
+        self.locks = {self.query_conn: threading.Lock(), self.update_conn: threading.Lock()}
+        self.process = context.Process(target=shard_main, name=f"koala-{name}", daemon=True,
+                                       args=(path, query_child, update_child, engine_options))
+        self.process.start()
+
+    def _call(self, conn, command: str, *args) -> Any:
+        with self.locks[conn]:
+            conn.send((command, args))
+            status, result = conn.recv()
+        if status == "error":
+            raise RuntimeError(f"Shard {self.name} failed on {command}: {result}")
+        return result
+
+    def query(self, command: str, *args) -> Any:
+        return self._call(self.query_conn, command, *args)
+
+    def update(self, command: str, *args) -> Any:
+        return self._call(self.update_conn, command, *args)
+
+    def close(self):
+        for conn in (self.update_conn, self.query_conn):
+            try:
+                self._call(conn, "close")
+            except (OSError, EOFError):
+                pass
+        self.process.join(timeout=10)
+
+def merge_cache_stats(stats: List[Dict]) -> Dict:
+    merged = {}
+    for name in ("query_vectors", "results"):
+        hits = sum(s[name]["hits"] for s in stats)
+        misses = sum(s[name]["misses"] for s in stats)
+        merged[name] = {
+            "size": sum(s[name]["size"] for s in stats),
+            "max_size": sum(s[name]["max_size"] for s in stats),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0
+        }
+    return merged
+
+# Coordinator with the same search interface as SearchEngine. Documents are partitioned
+# across shard processes by URL or domain; each query is ranked on every shard in parallel,
+# the per-shard lists are merged, and snippets come from the shards owning the page's hits.
+class ShardedSearchEngine:
+    def __init__(self, path: str = "shards", num_shards: int = 2, strategy: str = "hash",
+                 engine_options: Optional[Dict] = None, max_results: int = 500,
+                 cache_size: int = 1024, cache_ttl: float = 300.0):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.manifest_path = os.path.join(path, "shards.json")
+        self.engine_options = dict(engine_options or {}, max_results=max_results)
+        self.max_results = max_results
+        self.context = multiprocessing.get_context("spawn")
+        self.topology_lock = threading.RLock()
+        self.cursor_cache = LRUCache(cache_size, cache_ttl)
+        self.generation = 0
+
+        manifest = self._load_manifest()
+        if manifest is None:
+            if strategy not in SHARD_STRATEGIES:
+                raise ValueError(f"Unknown shard strategy '{strategy}', expected one of {SHARD_STRATEGIES}")
+            manifest = {"strategy": strategy, "shards": [f"shard-{i:03d}" for i in range(num_shards)]}
+            self._save_manifest(manifest)
+        elif manifest["strategy"] != strategy or len(manifest["shards"]) != num_shards:
+            print(f"[INFO] Using existing shard layout: {len(manifest['shards'])} shards by {manifest['strategy']}")
+        self.strategy = manifest["strategy"]
+        self.shards: Dict[str, ShardClient] = {}
+        for name in manifest["shards"]:
+            self._start_shard(name)
+        self.pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="koala-shards")
+
+    def _load_manifest(self) -> Optional[Dict]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def _save_manifest(self, manifest: Dict):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _start_shard(self, name: str):
+        self.shards[name] = ShardClient(name, os.path.join(self.path, name), self.engine_options, self.context)
+
+    def _fan_out(self, fn: Callable[[ShardClient], Any], shards: Optional[List[ShardClient]] = None) -> List[Any]:
+        shards = list(self.shards.values()) if shards is None else shards
+        return list(self.pool.map(fn, shards))
+
+    def shard_for(self, url: str) -> str:
+        return assign_shard(url, list(self.shards), self.strategy)
+
+    # Searches run against a snapshot of the shard list and never wait for ingests or a
+    # rebalance; a page being moved can briefly exist on two shards, so hits are de-duplicated
+    # by URL when the lists are merged.
+    def search_batch(self, requests: List[Dict]) -> List[Dict]:
+        shards = list(self.shards.values())
+        with SEARCH_STAGE.time(stage="scatter"):
+            shard_results = self._fan_out(lambda shard: shard.query("rank", requests), shards)
+
+        ranked_lists = []
+        for position, request in enumerate(requests):
+            hits = [(doc_id, url, score, span, shard.name)
+                    for shard, ranked in zip(shards, shard_results)
+                    for doc_id, url, score, span in ranked[position]["hits"]]
+            hits.sort(key=lambda hit: hit[2], reverse=request.get("sort_by", "score") != "relevance")
+            seen = set()
+            merged = [hit for hit in hits if not (hit[1] in seen or seen.add(hit[1]))]
+            ranked_lists.append({
+                "id": secrets.token_urlsafe(12),
+                "query": request["query"],
+                "hits": merged[:self.max_results],
+                "total": sum(ranked[position]["total"] for ranked in shard_results)
+            })
+        with SEARCH_STAGE.time(stage="snippet"):
+            return [self._paginate(ranked, request.get("per_page", 5),
+                                   (request.get("page", 1) - 1) * request.get("per_page", 5), request.get("cursor", True))
+                    for ranked, request in zip(ranked_lists, requests)]
+
+    def search_cursor(self, cursor: str, per_page: int = 5) -> Dict:
+        list_id, offset = decode_cursor(cursor)
+        ranked = self.cursor_cache.get(list_id)
+        if ranked is None:
+            raise ValueError("Cursor has expired, repeat the search")
+        with SEARCH_STAGE.time(stage="snippet"):
+            return self._paginate(ranked, per_page, offset)
+
+    # Snippets for a page are requested from the shards that returned its hits, one call per shard.
+    def _paginate(self, ranked: Dict, per_page: int, offset: int, keep_cursor: bool = True) -> Dict:
+        if keep_cursor:
+            self.cursor_cache.put(ranked["id"], ranked)
+        hits = ranked["hits"][offset:offset + per_page]
+        by_shard: Dict[str, List[int]] = defaultdict(list)
+        for position, hit in enumerate(hits):
+            by_shard[hit[4]].append(position)
+
+        def fetch(shard: ShardClient) -> Tuple[List[int], List[Tuple[str, List]]]:
+            positions = by_shard[shard.name]
+            items = [(hits[p][0], ranked["query"], hits[p][3]) for p in positions]
+            return positions, shard.query("snippets", items)
+
+        snippets: List[Tuple[str, List]] = [("", [])] * len(hits)
+        shards = [shard for name, shard in list(self.shards.items()) if name in by_shard]
+        for positions, shard_snippets in self._fan_out(fetch, shards):
+            for position, snippet in zip(positions, shard_snippets):
+                snippets[position] = snippet
+
+        next_offset = offset + per_page
+        return {
+            "results": [(hit[1], hit[2], snippet, highlights) for hit, (snippet, highlights) in zip(hits, snippets)],
+            "total": ranked["total"],
+            "page": offset // per_page + 1,
+            "next_cursor": encode_cursor(ranked["id"], next_offset)
+            if keep_cursor and next_offset < len(ranked["hits"]) else None
+        }
+
+    # Writes pages to the shards that own them and deletes the given URLs wherever they live;
+    # each shard then brings its lexical index up to date, only for these pages if incremental.
+    def ingest(self, pages: List[Dict], delete_urls: List[str] = (),
+               validators: Optional[Dict[str, Dict]] = None, incremental: bool = False) -> Dict[str, int]:
+        with self.topology_lock:
+            routed = {name: ([], [], {}) for name in self.shards}
+            for page in pages:
+                routed[self.shard_for(page["url"])][0].append(page)
+            for url in delete_urls:
+                routed[self.shard_for(url)][1].append(url)
+            for url, values in (validators or {}).items():
+                routed[self.shard_for(url)][2][url] = values
+            results = self._fan_out(lambda shard: shard.update("ingest", *routed[shard.name], incremental))
+        return {key: sum(result[key] for result in results) for key in ("written", "unchanged", "removed")}
+
+    def urls_with_prefix(self, prefix: str) -> List[str]:
+        with self.topology_lock:
+            return [url for urls in self._fan_out(lambda shard: shard.update("urls", prefix)) for url in urls]
+
+    def validators_with_prefix(self, prefix: str) -> Dict[str, Dict]:
+        merged = {}
+        with self.topology_lock:
+            for validators in self._fan_out(lambda shard: shard.update("validators", prefix)):
+                merged.update(validators)
+        return merged
+
+    def sync_index(self, persist: bool = True, doc_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        with self.topology_lock:
+            results = self._fan_out(lambda shard: shard.update("sync", persist, doc_ids))
+        self.generation += 1
+        return {key: sum(result[key] for result in results) for key in ("embedded", "passages", "removed")}
+
+    # Starts a new shard process and moves over the documents it now owns under rendezvous
+    # hashing, in batches, then re-syncs the affected indexes.
+    def add_shard(self, batch_size: int = 200) -> Dict:
+        with self.topology_lock:
+            name = f"shard-{len(self.shards):03d}"
+            while name in self.shards:
+                name = f"shard-{secrets.token_hex(3)}"
+            old_shards = list(self.shards.values())
+            self._start_shard(name)
+            names = list(self.shards)
+            self._save_manifest({"strategy": self.strategy, "shards": names})
+            new_shard = self.shards[name]
+
+            moved = 0
+            for shard in old_shards:
+                urls = shard.update("moved_urls", names, self.strategy, shard.name)
+                for start in range(0, len(urls), batch_size):
+                    batch = urls[start:start + batch_size]
+                    entries, validators = shard.update("export", batch)
+                    new_shard.update("ingest", entries, [], validators)
+                    shard.update("ingest", [], batch, {})
+                    moved += len(entries)
+            index_update = self.sync_index()
+        print(f"[INFO] Added {name}: moved {moved} documents")
+        return {"shard": name, "moved": moved, "index_update": index_update}
+
+    def warm_up(self):
+        self._fan_out(lambda shard: shard.query("warm_up"), list(self.shards.values()))
+
+    def shard_stats(self) -> Dict[str, Dict]:
+        shards = list(self.shards.values())
+        return {shard.name: stats for shard, stats in zip(shards, self._fan_out(
+            lambda shard: shard.query("stats"), shards))}
+
+    def index_stats(self) -> Dict[str, int]:
+        stats = self.shard_stats().values()
+        return {"documents": sum(s["documents"] for s in stats), "passages": sum(s["passages"] for s in stats)}
+
+    def cache_stats(self) -> Dict:
+        shard_caches = [s["cache"] for s in self.shard_stats().values() if s["cache"]]
+        return dict(merge_cache_stats(shard_caches), generation=self.generation, cursors=self.cursor_cache.stats())
+
+    def close(self):
+        with self.topology_lock:
+            self._fan_out(lambda shard: shard.close())
+        self.pool.shutdown()
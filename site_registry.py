@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+from typing import Dict, List, Optional
+
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+def write_json_atomic(path: str, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Could not read {path}: {e}")
+        return default
+
+# Websites and crawl jobs live in memory behind one lock; every change marks the registry
+# dirty and a background thread writes both files atomically at most once per interval,
+# so request handlers and crawl progress callbacks never wait on the disk.
+class SiteRegistry:
+    def __init__(self, websites_path: str = "websites.json", jobs_path: str = "crawl_jobs.json",
+                 flush_interval: float = 1.0, max_finished_jobs: int = 1000):
+        self.websites_path = websites_path
+        self.jobs_path = jobs_path
+        self.flush_interval = flush_interval
+        self.max_finished_jobs = max_finished_jobs
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.changed = threading.Event()
+        self.closed = threading.Event()
+
+        self.websites: Dict[str, Dict] = {w["id"]: w for w in read_json(websites_path, [])}
+        self.jobs: Dict[str, Dict] = {j["id"]: j for j in read_json(jobs_path, [])}
+        self.version = 0
+        self.flushed_version = 0
+
+        # Jobs that were queued or running when the process stopped can never finish; their
+        # checkpoints are still on disk, so a recrawl resumes them.
+        for job in self.jobs.values():
+            if job["status"] in ACTIVE_JOB_STATUSES:
+                job["status"] = "interrupted"
+                job["error_message"] = "Server stopped before the crawl finished"
+                self.version += 1
+        for website in self.websites.values():
+            if website.get("status") in ("pending", "crawling"):
+                website["status"] = "interrupted"
+                self.version += 1
+        if self.version:
+            self.changed.set()
+
+        self.writer = threading.Thread(target=self._write_behind, name="registry-writer", daemon=True)
+        self.writer.start()
+
+    def _touch(self):
+        self.version += 1
+        self.changed.set()
+
+    def _write_behind(self):
+        while not self.closed.is_set():
+            self.changed.wait()
+            if self.closed.wait(self.flush_interval):
+                break
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[WARNING] Could not persist websites and crawl jobs: {e}")
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                self.changed.clear()
+                if self.version == self.flushed_version:
+                    return
+                version = self.version
+                websites = [dict(w) for w in self.websites.values()]
+                jobs = [dict(j) for j in self.jobs.values()]
+            write_json_atomic(self.websites_path, websites)
+            write_json_atomic(self.jobs_path, jobs)
+            self.flushed_version = version
+
+    def close(self):
+        self.closed.set()
+        self.changed.set()
+        self.writer.join()
+        self.flush()
+
+    def list_websites(self) -> List[Dict]:
+        with self.lock:
+            return [dict(w) for w in self.websites.values()]
+
+    def get_website(self, website_id: str) -> Optional[Dict]:
+        with self.lock:
+            website = self.websites.get(website_id)
+            return dict(website) if website else None
+
+    def add_website(self, website: Dict) -> bool:
+        with self.lock:
+            if any(w["url"] == website["url"] for w in self.websites.values()):
+                return False
+            self.websites[website["id"]] = dict(website)
+            self._touch()
+            return True
+
+    def update_website(self, website_id: str, **fields) -> Optional[Dict]:
+        with self.lock:
+            website = self.websites.get(website_id)
+            if website is None:
+                return None
+            website.update(fields)
+            self._touch()
+            return dict(website)
+
+    def remove_website(self, website_id: str) -> bool:
+        with self.lock:
+            if self.websites.pop(website_id, None) is None:
+                return False
+            self._touch()
+            return True
+
+    def list_jobs(self) -> List[Dict]:
+        with self.lock:
+            return [dict(j) for j in self.jobs.values()]
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def active_jobs(self, website_id: Optional[str] = None) -> List[Dict]:
+        with self.lock:
+            return [dict(j) for j in self.jobs.values() if j["status"] in ACTIVE_JOB_STATUSES
+                    and (website_id is None or j["website_id"] == website_id)]
+
+    def add_job(self, job: Dict) -> bool:
+        with self.lock:
+            if any(j["website_id"] == job["website_id"] and j["status"] in ACTIVE_JOB_STATUSES
+                   for j in self.jobs.values()):
+                return False
+            self.jobs[job["id"]] = dict(job)
+            self._prune_jobs()
+            self._touch()
+            return True
+
+    def update_job(self, job_id: str, **fields) -> Optional[Dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            self._touch()
+            return dict(job)
+
+    def count_jobs(self) -> Dict[str, int]:
+        with self.lock:
+            counts: Dict[str, int] = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+    def _prune_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] not in ACTIVE_JOB_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
@@ -0,0 +1,88 @@
+import re
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# Same tokens as bm25_index.TOKEN_PATTERN, matched case-insensitively so offsets refer to the
+# original text (lowercasing first can change string length for some characters).
+OFFSET_PATTERN = re.compile(r"[a-z0-9](?:[a-z0-9_.\-]*[a-z0-9])?", re.IGNORECASE)
+SENTENCE_END_PATTERN = re.compile(r"[.!?]+\s+")
+
+def term_offsets(text: str) -> Dict[str, array]:
+    offsets: Dict[str, array] = defaultdict(lambda: array('I'))
+    for match in OFFSET_PATTERN.finditer(text):
+        offsets[match.group().lower()].append(match.start())
+    return offsets
+
+def sentence_starts(text: str) -> array:
+    starts = array('I', [0])
+    starts.extend(match.end() for match in SENTENCE_END_PATTERN.finditer(text) if match.end() < len(text))
+    return starts
+
+def _sentence_start(starts: array, position: int) -> int:
+    low, high = 0, len(starts) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if starts[mid] <= position:
+            low = mid
+        else:
+            high = mid - 1
+    return starts[low]
+
+def _best_window(hits: List[Tuple[int, int, str]], max_chars: int) -> Tuple[int, int]:
+    # Two pointers over the hits: the window covering the most distinct query terms wins,
+    # ties broken by the number of hits.
+    best, best_score = (0, 1), (-1, -1)
+    counts: Dict[str, int] = defaultdict(int)
+    right = 0
+    for left in range(len(hits)):
+        # A hit longer than max_chars on its own is a window of one.
+        if right <= left:
+            counts[hits[left][2]] += 1
+            right = left + 1
+        while right < len(hits) and hits[right][1] - hits[left][0] <= max_chars:
+            counts[hits[right][2]] += 1
+            right += 1
+        score = (sum(1 for count in counts.values() if count > 0), right - left)
+        if score > best_score:
+            best, best_score = (left, right), score
+        counts[hits[left][2]] -= 1
+    return best
+
+# Picks the snippet window from precomputed offsets: only the query terms' positions and the
+# sentence starts are examined, and only the chosen window of text is touched. `text` may be a
+# document_store.StoredText, which decodes just the ranges sliced or searched here.
+def make_snippet(text: str, starts: Optional[array], offsets: Dict[str, array],
+                 span: Optional[Tuple[int, int]] = None, max_chars: int = 200) -> Tuple[str, List[Tuple[int, int]]]:
+    low, high = span if span is not None else (0, len(text))
+    hits = sorted(
+        (position, position + len(term), term)
+        for term, positions in offsets.items() for position in positions
+        if low <= position and position + len(term) <= high
+    )
+
+    start = low
+    if hits:
+        first, last = _best_window(hits, max_chars)
+        hit_start, hit_end = hits[first][0], hits[last - 1][1]
+        if starts:
+            start = max(low, _sentence_start(starts, hit_start))
+        # Start at the sentence when it fits; otherwise keep some context before the first
+        # hit, beginning at a word.
+        if hit_end - start > max_chars:
+            start = max(low, hit_start - (max_chars - (hit_end - hit_start)) // 3)
+            space = text.find(' ', start, hit_start)
+            if start > low and space != -1:
+                start = space + 1
+    end = min(high, start + max_chars)
+
+    if end < high:
+        space = text.rfind(' ', start, end)
+        if space > start and (not hits or space >= hits[last - 1][1]):
+            end = space
+
+    prefix = "..." if start > 0 else ""
+    snippet = prefix + text[start:end] + ("..." if end < len(text) else "")
+    highlights = [(position - start + len(prefix), hit_end - start + len(prefix))
+                  for position, hit_end, _ in hits if start <= position and hit_end <= end]
+    return snippet, highlights
@@ -2,11 +2,18 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 
 from search_api import app as search_app
 
-app = FastAPI(title="Koala Search - Full Stack", version="1.0.0")
+# Mounted apps do not get lifespan events of their own, so the API's preload and shutdown run from here.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with search_app.router.lifespan_context(search_app):
+        yield
+
+app = FastAPI(title="Koala Search - Full Stack", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,219 @@
+import os
+import faiss
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq8", "pq")
+# Index types that hold compressed codes; their hits are re-scored against the full-precision store.
+QUANTIZED_TYPES = ("ivfpq", "sq8", "pq")
+# Index types whose quantizer or coarse centroids are learned from the vectors present at build time.
+TRAINED_TYPES = ("ivf", "ivfpq", "sq8", "pq")
+
+# Full-precision vectors, append-only on disk. Rows are float32 in `<path>.f32`
+# with the owning id in `<path>.ids`; removed rows are tombstoned with id -1.
+class VectorStore:
+    def __init__(self, path: str, dim: int):
+        self.dim = dim
+        self.vectors_path = f"{path}.f32"
+        self.ids_path = f"{path}.ids"
+        self.rows: Dict[int, int] = {}
+        self.total_rows = 0
+        self._mmap: Optional[np.memmap] = None
+
+        if os.path.exists(self.vectors_path) and os.path.exists(self.ids_path):
+            row_ids = np.fromfile(self.ids_path, dtype='int64')
+            self.total_rows = min(len(row_ids), os.path.getsize(self.vectors_path) // (4 * dim))
+            # Drop a torn trailing write so both files stay row-aligned.
+            os.truncate(self.ids_path, self.total_rows * 8)
+            os.truncate(self.vectors_path, self.total_rows * 4 * dim)
+            self.rows = {int(doc_id): row for row, doc_id in enumerate(row_ids[:self.total_rows]) if doc_id >= 0}
+        else:
+            open(self.vectors_path, 'wb').close()
+            open(self.ids_path, 'wb').close()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self.rows
+
+    def ids(self) -> List[int]:
+        return list(self.rows)
+
+    def _matrix(self) -> np.ndarray:
+        if self._mmap is None or self._mmap.shape[0] != self.total_rows:
+            if self.total_rows == 0:
+                return np.empty((0, self.dim), dtype='float32')
+            self._mmap = np.memmap(self.vectors_path, dtype='float32', mode='r',
+                                   shape=(self.total_rows, self.dim))
+        return self._mmap
+
+    def append(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = np.asarray(list(ids), dtype='int64')
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        self.remove(int(doc_id) for doc_id in ids if int(doc_id) in self.rows)
+        with open(self.vectors_path, 'ab') as file:
+            file.write(vectors.tobytes())
+        with open(self.ids_path, 'ab') as file:
+            file.write(ids.tobytes())
+        for offset, doc_id in enumerate(ids):
+            self.rows[int(doc_id)] = self.total_rows + offset
+        self.total_rows += len(ids)
+
+    def remove(self, ids: Iterable[int]):
+        rows = [self.rows.pop(doc_id) for doc_id in ids if doc_id in self.rows]
+        if not rows:
+            return
+        row_ids = np.memmap(self.ids_path, dtype='int64', mode='r+', shape=(self.total_rows,))
+        row_ids[rows] = -1
+        row_ids.flush()
+        del row_ids
+
+    def get(self, ids: Iterable[int]) -> np.ndarray:
+        rows = [self.rows[doc_id] for doc_id in ids]
+        return np.asarray(self._matrix()[rows], dtype='float32')
+
+    def iter_batches(self, batch_size: int = 10000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        items = sorted(self.rows.items(), key=lambda item: item[1])
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            ids = np.array([doc_id for doc_id, _ in batch], dtype='int64')
+            yield ids, np.asarray(self._matrix()[[row for _, row in batch]], dtype='float32')
+
+    def sample(self, n: int, seed: int = 0) -> np.ndarray:
+        rows = np.array(sorted(self.rows.values()), dtype='int64')
+        if len(rows) > n:
+            rows = np.sort(np.random.default_rng(seed).choice(rows, n, replace=False))
+        return np.asarray(self._matrix()[rows], dtype='float32')
+
+    def compact(self):
+        if self.total_rows == len(self.rows):
+            return
+        tmp_vectors, tmp_ids = f"{self.vectors_path}.tmp", f"{self.ids_path}.tmp"
+        new_rows = {}
+        with open(tmp_vectors, 'wb') as vector_file, open(tmp_ids, 'wb') as id_file:
+            for ids, vectors in self.iter_batches():
+                vector_file.write(vectors.tobytes())
+                id_file.write(ids.tobytes())
+                for doc_id in ids:
+                    new_rows[int(doc_id)] = len(new_rows)
+        self._mmap = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_ids, self.ids_path)
+        self.rows = new_rows
+        self.total_rows = len(new_rows)
+
+def default_nlist(n: int) -> int:
+    return max(1, min(4096, int(4 * np.sqrt(n))))
+
+def min_train_size(index_type: str, nlist: int, pq_nbits: int = 8) -> int:
+    if index_type == "ivf":
+        return 39 * nlist
+    if index_type == "ivfpq":
+        return max(39 * nlist, 39 * (1 << pq_nbits))
+    if index_type == "pq":
+        return 39 * (1 << pq_nbits)
+    if index_type == "sq8":
+        # Per-dimension value ranges learned from a few vectors clip most of a larger corpus.
+        return 1000
+    return 0
+
+def supports_remove(index_type: str) -> bool:
+    return index_type != "hnsw"
+
+# IndexPQ::search only accepts SearchParametersPQ and rejects an ID selector.
+def supports_selector(index_type: str) -> bool:
+    return index_type != "pq"
+
+def build_index(index_type: str, dim: int, store: VectorStore, nlist: Optional[int] = None,
+                hnsw_m: int = 32, ef_construction: int = 80, pq_m: int = 48, pq_nbits: int = 8):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    nlist = nlist or default_nlist(len(store))
+    if index_type == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = ef_construction
+        index = faiss.IndexIDMap2(hnsw)
+    elif index_type == "ivf":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "sq8":
+        index = faiss.IndexIDMap2(faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit,
+                                                             faiss.METRIC_INNER_PRODUCT))
+    elif index_type == "pq":
+        index = faiss.IndexIDMap2(faiss.IndexPQ(dim, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT))
+    else:
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        index.train(store.sample(max(min_train_size(index_type, nlist, pq_nbits), 256 * nlist)))
+
+    for ids, vectors in store.iter_batches():
+        index.add_with_ids(vectors, ids)
+    return index
+
+def search_params(index_type: str, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  sel=None):
+    if index_type in ("ivf", "ivfpq") and (nprobe or sel is not None):
+        params = faiss.SearchParametersIVF()
+        if nprobe:
+            params.nprobe = nprobe
+    elif index_type == "hnsw" and (ef_search or sel is not None):
+        params = faiss.SearchParametersHNSW()
+        if ef_search:
+            params.efSearch = ef_search
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+def exact_search(store: VectorStore, ids: np.ndarray, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    ids = ids[[int(doc_id) in store for doc_id in ids]]
+    k = min(k, len(ids))
+    distances = np.full((len(queries), k), -np.inf, dtype='float32')
+    labels = np.full((len(queries), k), -1, dtype='int64')
+    if k == 0:
+        return distances, labels
+    scores = queries @ store.get(int(doc_id) for doc_id in ids).T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    for row in range(len(queries)):
+        order = top[row][np.argsort(-scores[row, top[row]])]
+        distances[row] = scores[row, order]
+        labels[row] = ids[order]
+    return distances, labels
+
+# Inverted lists (ivf/ivfpq) and flat codes are mapped from the file instead of copied into memory,
+# so a large index is usable right after load and pages are shared between processes.
+def load_index(path: str, mmap: bool = False):
+    if not mmap:
+        return faiss.read_index(path)
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    return faiss.read_index(path, flags)
+
+def write_index(index, path: str):
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+def rerank(store: VectorStore, queries: np.ndarray, labels: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    distances = np.full((len(queries), k), -np.inf, dtype='float32')
+    reranked = np.full((len(queries), k), -1, dtype='int64')
+    for row, query in enumerate(queries):
+        ids = np.array([doc_id for doc_id in labels[row] if doc_id >= 0 and int(doc_id) in store], dtype='int64')
+        if not len(ids):
+            continue
+        scores = store.get(int(doc_id) for doc_id in ids) @ query
+        order = np.argsort(-scores)[:k]
+        distances[row, :len(order)] = scores[order]
+        reranked[row, :len(order)] = ids[order]
+    return distances, reranked
+
+def index_memory_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)